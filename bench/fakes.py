@@ -0,0 +1,91 @@
+import datetime
+import itertools
+
+# Stand-ins for the parts of discord.py objects the bot touches. Every Discord
+# call resolves immediately and is only counted, so a benchmark measures the
+# bot's own work rather than the network.
+
+_ids = itertools.count(10**17)
+
+
+def snowflake():
+    return next(_ids)
+
+
+class FakeRole:
+    def __init__(self, name, id=None):
+        self.id = id or snowflake()
+        self.name = name
+
+
+class FakeGuild:
+    def __init__(self, name='bench', roles=()):
+        self.id = snowflake()
+        self.name = name
+        self.roles = list(roles)
+        self.text_channels = []
+
+
+class FakeMember:
+    bot = False
+
+    def __init__(self, name, roles=(), calls=None):
+        self.id = snowflake()
+        self.name = name
+        self.roles = list(roles)
+        self.mention = f"<@{self.id}>"
+        self.calls = calls if calls is not None else Calls()
+
+    async def send(self, content):
+        self.calls.dms += 1
+
+
+class FakeChannel:
+    def __init__(self, name, guild, calls=None):
+        self.id = snowflake()
+        self.name = name
+        self.guild = guild
+        self.calls = calls if calls is not None else Calls()
+        guild.text_channels.append(self)
+
+    async def send(self, content, delete_after=None):
+        self.calls.channel_messages += 1
+
+    async def delete_messages(self, messages):
+        self.calls.bulk_deletes += 1
+
+
+class FakeAttachment:
+    def __init__(self, filename, size, content_type=None):
+        self.id = snowflake()
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+        self.url = f"https://cdn.invalid/attachments/{self.id}/{filename}"
+
+
+class FakeMessage:
+    def __init__(self, author, channel, attachments=(), content=''):
+        self.id = snowflake()
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.attachments = list(attachments)
+        self.content = content
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    async def delete(self):
+        self.channel.calls.deletes += 1
+
+
+class Calls:
+    """Counts the Discord API calls made against the fakes."""
+
+    def __init__(self):
+        self.deletes = 0
+        self.bulk_deletes = 0
+        self.dms = 0
+        self.channel_messages = 0
+
+    def as_dict(self):
+        return dict(vars(self))
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import gc
+import json
+import mimetypes
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench.fakes import Calls, FakeAttachment, FakeChannel, FakeGuild, FakeMember, FakeMessage, FakeRole
+from bench.stats import percentile
+
+AUDIO_FILES = ('take.mp3', 'stem.wav', 'master.flac', 'memo.m4a', 'loop.ogg')
+OTHER_FILES = ('cover.png', 'notes.txt', 'clip.mp4', 'lyrics.pdf')
+
+
+def build_scenario(rng, channels=20, roles=6, users=500, messages=5000):
+    """Create a guild with role rules, members and a stream of upload messages."""
+    calls = Calls()
+    guild = FakeGuild(roles=[FakeRole(f"role-{i}") for i in range(roles)])
+    channel_list = [FakeChannel(f"channel-{i}", guild, calls) for i in range(channels)]
+    members = [FakeMember(f"user-{i}", rng.sample(guild.roles, rng.randint(0, 2)), calls) for i in range(users)]
+
+    settings = []
+    for channel in channel_list:
+        for order_index, role in enumerate(rng.sample(guild.roles, rng.randint(0, 3))):
+            settings.append((channel.id, role.name, rng.randint(1, 20), order_index,
+                             rng.choice(('daily', 'weekly')), None))
+    blocked = [channel_list[0].id]
+
+    stream = []
+    for _ in range(messages):
+        attachments = []
+        for _ in range(rng.randint(1, 3)):
+            # Roughly two thirds of attachments are audio and count against a limit
+            filename = rng.choice(AUDIO_FILES) if rng.random() < 0.65 else rng.choice(OTHER_FILES)
+            attachments.append(FakeAttachment(filename, rng.randint(10_000, 20_000_000), mimetypes.guess_type(filename)[0]))
+        stream.append(FakeMessage(rng.choice(members), rng.choice(channel_list), attachments))
+
+    return {'calls': calls, 'guild': guild, 'channels': channel_list, 'settings': settings,
+            'blocked': blocked, 'messages': stream}
+
+
+def seed(path, scenario, default_max_uploads=10):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO channel_names (channel_id, channel_name) VALUES (?, ?)",
+                     [(channel.id, channel.name) for channel in scenario['channels']])
+    conn.executemany("""
+        INSERT INTO channel_settings (channel_id, role_name, max_uploads, order_index, reset_frequency, timezone)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, scenario['settings'])
+    conn.executemany("INSERT INTO blocked_channels (channel_id) VALUES (?)", [(cid,) for cid in scenario['blocked']])
+    conn.execute("INSERT OR REPLACE INTO global_settings (id, default_max_uploads) VALUES (1, ?)", (default_max_uploads,))
+    conn.commit()
+    conn.close()
+
+
+def _rows_written(db_pool):
+    return sum(db._conn.total_changes for db in db_pool._all)
+
+
+async def _flush_due(service):
+    # Stands in for the flush loop: a flush that reached its threshold runs at the next burst boundary
+    wakeup = getattr(service, '_flush_wakeup', None)
+    if wakeup is not None and wakeup.is_set():
+        wakeup.clear()
+        await service.flush()
+
+
+async def _drain_moderation(moderation):
+    # Everything a burst queued goes out as one batch, instead of whatever the
+    # collector's wall-clock window happens to catch
+    batch = []
+    while not moderation._queue.empty():
+        batch.append(moderation._queue.get_nowait())
+    if batch:
+        await moderation._workers.acquire()
+        await moderation._run_batch(batch)
+
+
+async def _replay(bot_module, scenario, burst):
+    latencies = []
+
+    async def handle(message):
+        start = time.perf_counter()
+        await bot_module.on_message(message)
+        latencies.append(time.perf_counter() - start)
+
+    messages = scenario['messages']
+    # The prebuilt scenario is not part of the bot's heap; without this, full
+    # collections walking it stall whole bursts and decide the p99
+    gc.collect()
+    gc.freeze()
+    start = time.perf_counter()
+    # discord.py dispatches every gateway event as its own task; bursts reproduce that overlap
+    for offset in range(0, len(messages), burst):
+        await asyncio.gather(*(handle(message) for message in messages[offset:offset + burst]))
+        await _flush_due(bot_module.quota)
+        await _flush_due(bot_module.upload_log)
+        await _drain_moderation(bot_module.moderation)
+    elapsed = time.perf_counter() - start
+    gc.unfreeze()
+
+    await bot_module.quota.flush()
+    await bot_module.upload_log.flush()
+    return latencies, elapsed
+
+
+async def _run(path, scenario, burst):
+    # bot.bot opens its pool on DATABASE_PATH at import time
+    from bot import bot as bot_module
+
+    async def no_commands(message):
+        pass
+    bot_module.bot.process_commands = no_commands
+
+    await bot_module.migrate_database()
+    seed(path, scenario)
+
+    # The flush loops and the moderation collector run on wall-clock timers; the
+    # replay drives them at burst boundaries instead so every run does the same work
+    bot_module.moderation.start()
+    bot_module.moderation._collector.cancel()
+    rows_before = _rows_written(bot_module.db_pool)
+    try:
+        latencies, elapsed = await _replay(bot_module, scenario, burst)
+        rows_written = _rows_written(bot_module.db_pool) - rows_before
+    finally:
+        await bot_module.moderation.close()
+        await bot_module.quota.close()
+        await bot_module.upload_log.close()
+        await bot_module.db_pool.close()
+    return latencies, elapsed, rows_written
+
+
+def run(path, seed_value=1, messages=5000, burst=50):
+    """Replay synthetic upload traffic through bot.bot.on_message against the database at ``path``.
+
+    ``path`` must be the DATABASE_PATH the bot module was (or will be) imported with.
+    """
+    scenario = build_scenario(random.Random(seed_value), messages=messages)
+    latencies, elapsed, rows_written = asyncio.run(_run(path, scenario, burst))
+
+    count = len(scenario['messages'])
+    wal_path = path + '-wal'
+    db_bytes = os.path.getsize(path) + (os.path.getsize(wal_path) if os.path.exists(wal_path) else 0)
+    return {
+        'handler.messages': count,
+        'handler.messages_per_sec': count / elapsed,
+        'handler.p50_ms': percentile(latencies, 50) * 1000,
+        'handler.p99_ms': percentile(latencies, 99) * 1000,
+        'handler.rows_written': rows_written,
+        'handler.rows_written_per_message': rows_written / count,
+        'handler.db_bytes': db_bytes,
+        'handler.discord_calls': sum(scenario['calls'].as_dict().values()),
+    }
+
+
+def main(argv=None):
+    # bench.run starts each repeat in a fresh process, since bot.bot binds its database at import
+    parser = argparse.ArgumentParser(description="Replay synthetic upload traffic once and print the results as JSON.")
+    parser.add_argument('path', nargs='?', help='database to create (default: a temporary file)')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.path or os.path.join(directory, 'handler.db')
+        os.environ['DATABASE_PATH'] = path
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        json.dump(run(path, seed_value=args.seed, messages=args.messages), sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import datetime
+import random
+import statistics
+import sqlite3
+import time
+
+from bench.stats import percentile
+from shared import summary
+from shared.db import ConnectionPool
+
+CHANNELS = 50
+
+
+def copy_schema(source, path):
+    """Create the tables, indexes and triggers of the database at ``source`` in a new database."""
+    with sqlite3.connect(source) as src:
+        rows = src.execute("""
+            SELECT type, sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        """).fetchall()
+    order = {'table': 0, 'index': 1, 'trigger': 2}
+    conn = sqlite3.connect(path)
+    for _, sql in sorted(rows, key=lambda row: order.get(row[0], 3)):
+        conn.execute(sql)
+    conn.commit()
+    return conn
+
+
+def seed(conn, rows, rng):
+    channel_ids = list(range(1, CHANNELS + 1))
+    conn.executemany("INSERT INTO channel_names (channel_id, channel_name) VALUES (?, ?)",
+                     [(cid, f"channel-{cid}") for cid in channel_ids])
+    conn.executemany("INSERT INTO channel_settings (channel_id, role_name, max_uploads, order_index) VALUES (?, ?, ?, ?)",
+                     [(cid, f"role-{i}", rng.randint(1, 20), i) for cid in channel_ids for i in range(rng.randint(0, 3))])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    period_id = now.strftime('%Y-%m-%d')
+    uploads = []
+    user_id = 0
+    while len(uploads) < rows:
+        user_id += 1
+        for cid in rng.sample(channel_ids, min(rng.randint(1, 4), rows - len(uploads))):
+            uploads.append((user_id, cid, f"user-{user_id}", rng.randint(0, 20), now.isoformat(), period_id))
+    conn.executemany("""
+        INSERT INTO user_channel_uploads (user_id, channel_id, username, uploads, last_reset, period_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, uploads)
+    summary.refresh_top_uploaders(conn, channel_ids)
+    conn.commit()
+    return user_id
+
+
+def _time_route(client, url, iterations, revalidate=False):
+    headers = {}
+    if revalidate:
+        # Polling with the ETag of the page the client already has
+        headers['If-None-Match'] = client.get(url).headers['ETag']
+    expected = 304 if revalidate else 200
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        response.get_data()
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != expected:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return latencies
+
+
+def run(schema_source, directory, sizes=(1_000, 10_000, 100_000), iterations=30, repeat=5, seed_value=1):
+    """Time the overview routes with the Flask test client at several user_channel_uploads sizes."""
+    from dashboard import dashboard
+
+    client = dashboard.app.test_client()
+    databases = {}
+    for rows in sizes:
+        path = f"{directory}/dashboard-{rows}.db"
+        conn = copy_schema(schema_source, path)
+        databases[rows] = (path, seed(conn, rows, random.Random(seed_value)))
+        conn.close()
+
+    timings = {}
+    # Every round visits every size and route, so a slow stretch on a shared
+    # machine costs many metrics one round each instead of one metric all of them
+    for _ in range(repeat):
+        for rows, (path, users) in databases.items():
+            dashboard.db_pool.close()
+            dashboard.read_pool.close()
+            dashboard.db_pool = ConnectionPool(path)
+            dashboard.read_pool = ConnectionPool(path, readonly=True)
+            routes = {
+                'channels': ('/channels', False),
+                'users': ('/users', False),
+                'users_channel': (f"/users?channel_id={CHANNELS // 2}", False),
+                'users_deep_page': (f"/users?after={users * 9 // 10}:0", False),
+                'api_users': ('/api/users?limit=500', False),
+                # Repeated polling of an unchanged page
+                'users_revalidate': ('/users', True),
+            }
+            for name, (url, revalidate) in routes.items():
+                timings.setdefault((name, rows), []).append(_time_route(client, url, iterations, revalidate))
+    dashboard.db_pool.close()
+    dashboard.read_pool.close()
+
+    results = {}
+    for (name, rows), rounds in timings.items():
+        results[f"dashboard.{name}.{rows}.p50_ms"] = statistics.median(percentile(r, 50) for r in rounds) * 1000
+        results[f"dashboard.{name}.{rows}.p90_ms"] = statistics.median(percentile(r, 90) for r in rounds) * 1000
+    return results
@@ -0,0 +1,130 @@
+"""Offline benchmarks for the upload handler and the dashboard.
+
+    python -m bench.run                    # run and compare against bench/baseline.json
+    python -m bench.run --update-baseline  # run and store the results as the new baseline
+    python -m bench.run --quick            # smaller workload for a fast sanity check
+
+No Discord connection is needed: messages are fakes (see bench/fakes.py)
+replayed through the real on_message handler against a scratch SQLite
+database. Each result is the median of --repeat runs, and only metrics
+that are stable from run to run are compared: the exit status is non-zero
+when one of them is worse than the baseline by more than --tolerance. Tail
+latencies are reported but not compared. Baselines are machine-specific;
+regenerate them on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Metrics that are only reported; the workload size decides them
+INFORMATIONAL = ('handler.messages', 'handler.db_bytes', 'handler.discord_calls')
+# Tail latencies move with a single GC pause or scheduler hiccup, even over medians
+INFORMATIONAL_SUFFIXES = ('.p90_ms', '.p99_ms')
+
+
+def higher_is_better(name):
+    return name.endswith('_per_sec')
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """Return a description of every result that regressed by more than ``tolerance``.
+
+    Latencies also have to be ``min_delta_ms`` worse in absolute terms, so
+    millisecond-level jitter on fast routes is not reported.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None or name in INFORMATIONAL or name.endswith(INFORMATIONAL_SUFFIXES) or not expected:
+            continue
+        if higher_is_better(name):
+            regressed = value < expected * (1 - tolerance)
+        elif name.endswith('_ms'):
+            regressed = value > expected * (1 + tolerance) and value - expected > min_delta_ms
+        else:
+            regressed = value > expected * (1 + tolerance)
+        if regressed:
+            regressions.append(f"{name}: {value:.3f} (baseline {expected:.3f})")
+    return regressions
+
+
+def run_handler(path, messages, repeat):
+    """Median of ``repeat`` handler runs, each in a fresh process; the first one leaves its database at ``path``."""
+    runs = []
+    for index in range(repeat):
+        command = [sys.executable, '-m', 'bench.handler', '--messages', str(messages)]
+        if index == 0:
+            command.append(path)
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        runs.append(json.loads(output))
+    return {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='run a reduced workload')
+    parser.add_argument('--messages', type=int, help='number of messages to replay')
+    parser.add_argument('--sizes', help='comma separated user_channel_uploads sizes for the dashboard')
+    parser.add_argument('--repeat', type=int, help='runs to take the median of (default 5, 1 with --quick)')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative regression (default 0.5)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore latency changes smaller than this')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    messages = args.messages or (1000 if args.quick else 5000)
+    repeat = args.repeat or (1 if args.quick else 5)
+    if args.sizes:
+        sizes = tuple(int(size) for size in args.sizes.split(','))
+    else:
+        sizes = (1_000, 10_000) if args.quick else (1_000, 10_000, 100_000)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Both apps read these when first imported, so set them before importing either
+        path = os.path.join(directory, 'handler.db')
+        os.environ['DATABASE_PATH'] = path
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ.setdefault('FLASK_SECRET_KEY', 'bench')
+
+        from bench import routes
+        results = run_handler(path, messages, repeat)
+        results.update(routes.run(path, directory, sizes=sizes, repeat=repeat))
+
+    width = max(len(name) for name in results)
+    for name, value in sorted(results.items()):
+        print(f"{name:<{width}}  {value:12.3f}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('handler.messages') != results['handler.messages']:
+        print(f"Baseline replayed {baseline.get('handler.messages')} messages; handler results are not compared")
+        baseline = {name: value for name, value in baseline.items() if not name.startswith('handler.')}
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
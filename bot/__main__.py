@@ -1,4 +1,9 @@
-from bot import bot  # Import your main bot script or function
+from dotenv import load_dotenv, find_dotenv
+
+# Load environment variables before bot.bot reads them at import
+load_dotenv(find_dotenv(usecwd=True), override=True)
+
+from bot.bot import run_bot
 
 if __name__ == "__main__":
-    bot.main()  # Assuming your bot script has a main() function
+    run_bot()
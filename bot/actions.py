@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+
+import discord
+
+from bot.metrics import MODERATION_LATENCY_SECONDS, MODERATION_QUEUE_DEPTH, UPLOAD_PHASE_SECONDS
+
+log = logging.getLogger(__name__)
+
+# Discord only bulk-deletes messages younger than 14 days, between 2 and 100 at a time
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+BULK_DELETE_MAX_COUNT = 100
+
+
+class ModerationAction:
+    __slots__ = ('message', 'notice', 'forbidden_notice', 'enqueued_at')
+
+    def __init__(self, message, notice, forbidden_notice=None):
+        self.message = message
+        # Sent to the author once the message is gone
+        self.notice = notice
+        # Posted in the channel instead when the bot is not allowed to delete the message
+        self.forbidden_notice = forbidden_notice
+        self.enqueued_at = time.monotonic()
+
+
+class ModerationQueue:
+    """Deletes offending uploads and notifies their authors off the message handler.
+
+    A collector takes everything queued within ``batch_window`` seconds and
+    hands it to one of ``workers`` concurrent batch processors, which delete it
+    with one bulk request per channel where Discord allows, and merge all
+    notices for the same user into a single DM. discord.py already waits on
+    per-route rate-limit buckets; batching keeps the number of calls hitting
+    those buckets low, and ``max_concurrent_requests`` caps how many run at once.
+    """
+
+    def __init__(self, maxsize=1000, workers=2, batch_window=0.5, max_batch=200, max_concurrent_requests=5):
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = None
+        self._collector = None
+        self._workers = None
+        self._running = set()
+        self._requests = asyncio.Semaphore(max_concurrent_requests)
+
+        self.processed = 0
+        self.bulk_deletes = 0
+        self.coalesced_notices = 0
+        self._latencies = collections.deque(maxlen=1000)
+
+    def start(self):
+        if self._collector is None:
+            self._queue = asyncio.Queue(self.maxsize)
+            MODERATION_QUEUE_DEPTH.set_function(self._queue.qsize)
+            self._workers = asyncio.Semaphore(self.worker_count)
+            self._collector = asyncio.create_task(self._collect())
+
+    async def close(self, timeout=10):
+        if self._collector is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Dropping queued moderation actions on shutdown", extra={'fields': {'count': self._queue.qsize()}})
+        self._collector.cancel()
+        await asyncio.gather(self._collector, return_exceptions=True)
+        self._collector = None
+
+    async def enqueue(self, message, notice, forbidden_notice=None):
+        # Waits only when the queue is full, which bounds memory under a flood
+        await self._queue.put(ModerationAction(message, notice, forbidden_notice))
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'processed': self.processed,
+            'bulk_deletes': self.bulk_deletes,
+            'coalesced_notices': self.coalesced_notices,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _collect(self):
+        # A single collector keeps each user's notices in the same batch so they coalesce
+        while True:
+            batch = await self._next_batch()
+            await self._workers.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            await self._process(batch)
+        except Exception:
+            log.exception("Error processing moderation batch")
+        finally:
+            self._workers.release()
+            now = time.monotonic()
+            for action in batch:
+                self._latencies.append(now - action.enqueued_at)
+                MODERATION_LATENCY_SECONDS.observe(now - action.enqueued_at)
+                self._queue.task_done()
+            self.processed += len(batch)
+
+    async def _process(self, batch):
+        by_channel = {}
+        for action in batch:
+            by_channel.setdefault(action.message.channel.id, []).append(action)
+
+        results = await asyncio.gather(*(self._delete_channel_batch(actions) for actions in by_channel.values()),
+                                       return_exceptions=True)
+
+        notices = {}
+        for deleted in results:
+            if isinstance(deleted, Exception):
+                log.error("Error deleting moderated messages", exc_info=deleted)
+                continue
+            for action in deleted:
+                user_notices = notices.setdefault(action.message.author.id, (action, []))[1]
+                if action.notice not in user_notices:
+                    user_notices.append(action.notice)
+                else:
+                    self.coalesced_notices += 1
+
+        for result in await asyncio.gather(*(self._notify(action, texts) for action, texts in notices.values()),
+                                           return_exceptions=True):
+            if isinstance(result, Exception):
+                log.error("Error notifying user about moderated upload", exc_info=result)
+
+    async def _delete_channel_batch(self, actions):
+        """Delete a channel's messages; returns the actions whose message is now gone."""
+        channel = actions[0].message.channel
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - BULK_DELETE_MAX_AGE
+        bulk = [a for a in actions if getattr(a.message, 'created_at', cutoff) > cutoff]
+        single = [a for a in actions if a not in bulk]
+
+        deleted = []
+        if len(bulk) >= 2 and hasattr(channel, 'delete_messages'):
+            for start in range(0, len(bulk), BULK_DELETE_MAX_COUNT):
+                chunk = bulk[start:start + BULK_DELETE_MAX_COUNT]
+                try:
+                    async with self._requests:
+                        with UPLOAD_PHASE_SECONDS.labels('delete').time():
+                            await channel.delete_messages([a.message for a in chunk])
+                    self.bulk_deletes += 1
+                    deleted.extend(chunk)
+                except (discord.errors.Forbidden, discord.errors.HTTPException):
+                    # Missing Manage Messages or a message vanished; fall back to one-by-one
+                    single.extend(chunk)
+        else:
+            single.extend(bulk)
+
+        for action in single:
+            if await self._delete_one(action):
+                deleted.append(action)
+        return deleted
+
+    async def _delete_one(self, action):
+        message = action.message
+        try:
+            async with self._requests:
+                with UPLOAD_PHASE_SECONDS.labels('delete').time():
+                    await message.delete()
+            return True
+        except discord.errors.NotFound:
+            log.debug("Message was already deleted", extra={'fields': {'message_id': message.id}})
+        except discord.errors.Forbidden:
+            log.warning("Missing permission to delete message", extra={'fields': {'message_id': message.id}})
+            if action.forbidden_notice:
+                async with self._requests:
+                    await message.channel.send(f"{message.author.mention}, {action.forbidden_notice}")
+        return False
+
+    async def _notify(self, action, texts):
+        user = action.message.author
+        channel = action.message.channel
+        content = "\n".join(texts)
+        try:
+            async with self._requests:
+                with UPLOAD_PHASE_SECONDS.labels('dm').time():
+                    await user.send(content)
+            log.debug("Private message sent", extra={'fields': {'user_id': user.id}})
+        except Exception as e:
+            if not isinstance(e, discord.errors.Forbidden):
+                log.warning("Unexpected error sending private message", exc_info=e)
+            log.debug("Unable to DM user, notifying in channel", extra={'fields': {'user_id': user.id}})
+            async with self._requests:
+                with UPLOAD_PHASE_SECONDS.labels('dm').time():
+                    await channel.send(f"{user.mention} {content}", delete_after=10)
@@ -1,32 +1,30 @@
+import asyncio
 import discord
 from discord.ext import commands
-import aiosqlite
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import datetime
-import pytz
 import os
-from dotenv import load_dotenv, find_dotenv
-
-# Load environment variables (unchanged)
-dotenv_path = find_dotenv(usecwd=True)
-print(f".env file path: {dotenv_path}")
-
-if not dotenv_path:
-    print("Error: .env file not found!")
-else:
-    print("\nAttempting to load .env file:")
-    load_result = load_dotenv(dotenv_path, override=True, verbose=True)
-
-# Debug print (unchanged)
-token = os.getenv('DISCORD_BOT_TOKEN')
-if token:
-    print(f"Token loaded (first 10 chars): {token[:10]}...")
-    print(f"Token length: {len(token)}")
-else:
-    print("ERROR: No token found in environment variables")
-
-# Bot setup (unchanged)
+import time
+import logging
+from bot.actions import ModerationQueue
+from bot.classify import AttachmentClassifier
+from bot.channel_sync import ChannelNameSync
+from bot import events, migrations
+from bot.metrics import JOB_SECONDS, UPLOAD_DECISIONS_TOTAL, UPLOAD_PHASE_SECONDS, start_metrics_server
+from bot.quota import create_quota, refresh_top_uploaders
+from bot.ratelimit import BurstLimiter
+from bot.rules import RuleIndex
+from bot import sharding
+from shared.db import AsyncConnectionPool
+from shared import notify, periods
+from shared.cache import TTLCache
+from shared.log import setup_logging
+
+# Environment variables (.env) are loaded by the entry point (bot/__main__.py, run.py) before this import
+setup_logging()
+log = logging.getLogger(__name__)
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guild_messages = True
@@ -35,128 +33,256 @@ intents.guild_reactions = True
 intents.dm_reactions = True
 intents.guilds = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+# Long-lived connections shared by every handler (see shared/db.py)
+db_pool = AsyncConnectionPool(size=int(os.getenv('DATABASE_POOL_SIZE', 4)))
+
+# Upload counters: served from memory with batched write-back, or decided in SQLite when
+# several shard processes share the database (QUOTA_BACKEND, see bot/quota.py)
+quota = create_quota(db_pool, processes=sharding.process_count())
+
+# Compiled per-channel rules, rebuilt when the dashboard reports a change; entries are
+# checked against settings_versions every RULES_RECHECK_SECONDS in case a report was lost
+rule_index = RuleIndex(db_pool, recheck_after=float(os.getenv('RULES_RECHECK_SECONDS', 300)))
+
+# Deletions and DMs run off the message handler, batched per channel and per user
+moderation = ModerationQueue()
+
+# Token buckets per (user, channel) and per channel for short-term burst limits
+bursts = BurstLimiter()
+
+# Decides which attachments are audio; sniffs content when CLASSIFIER_SNIFF_BYTES is set
+classifier = AttachmentClassifier.from_env()
+
+# What to do when a user re-uploads a file they already uploaded in the channel during
+# the current reset window: 'count' it again, 'skip' it when counting, or 'reject' the message
+DUPLICATE_UPLOAD_POLICY = os.getenv('DUPLICATE_UPLOAD_POLICY', 'count')
+# Keyed by (user_id, channel_id, period_id, digest); the TTL only has to outlive the longest window
+recent_uploads = TTLCache(maxsize=int(os.getenv('DUPLICATE_CACHE_SIZE', 100_000)), ttl=periods.STALE_AFTER.total_seconds())
+
+# Append-only history of upload decisions with hourly/daily rollups for the dashboard
+upload_log = events.UploadEventLog(db_pool)
+
+# channel_names follows gateway events; a full comparison only runs at startup
+channel_sync = ChannelNameSync(db_pool)
+
+def handle_change_notification(message):
+    kind = message['kind']
+    if kind == 'channel':
+        channel_id = message['channel_id']
+        rule_index.invalidate(channel_id, message.get('version'))
+        channel = bot.get_channel(channel_id)
+        if channel is not None and getattr(channel, 'guild', None) is not None:
+            # Rebuild the affected entry now rather than on the next upload
+            asyncio.create_task(rule_index.get(channel_id, channel.guild))
+    elif kind == 'global':
+        rule_index.invalidate_global(message.get('version'))
+    elif kind == 'counter':
+        quota.invalidate_counter(message['user_id'], message['channel_id'])
+    elif kind == 'counters':
+        quota.invalidate_counters()
+    elif kind == 'reset_role':
+        asyncio.create_task(reset_role_counters(message['role_name'], message.get('channel_ids')))
+
+class UploadLimitBot(commands.AutoShardedBot):
+    # Set by the first on_ready; later ones are reconnects
+    ready_once = False
+
+    async def setup_hook(self):
+        # Runs once per process, before the gateway connects
+        await migrate_database()
+        quota.start()
+        upload_log.start()
+        moderation.start()
+        bursts.start()
+        try:
+            self.notify_transport = await notify.listen(handle_change_notification, sharding.process_index())
+        except OSError as e:
+            self.notify_transport = None
+            log.warning("Unable to listen for dashboard change notifications", extra={'fields': {'error': str(e)}})
+        try:
+            self.metrics_runner = await start_metrics_server(sharding.process_index())
+        except OSError as e:
+            self.metrics_runner = None
+            log.warning("Unable to start metrics server", extra={'fields': {'error': str(e)}})
+
+        # Maintenance jobs run once per deployment, in the first shard process
+        if sharding.is_primary():
+            scheduler.add_job(purge_stale_uploads, CronTrigger(hour=4, minute=30),
+                              id='purge_stale_uploads', replace_existing=True)
+            scheduler.start()
+            log.info("Scheduler started")
+
+    async def close(self):
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await bursts.close()
+        await moderation.close()
+        # Persist any pending upload counts and channel names before disconnecting
+        try:
+            await channel_sync.flush()
+        except Exception as e:
+            log.exception("Error syncing channel names on shutdown")
+        try:
+            await quota.close()
+        except Exception as e:
+            log.exception("Error flushing upload counters on shutdown")
+        try:
+            await upload_log.close()
+        except Exception as e:
+            log.exception("Error flushing upload events on shutdown")
+        await classifier.close()
+        if getattr(self, 'notify_transport', None) is not None:
+            self.notify_transport.close()
+        if getattr(self, 'metrics_runner', None) is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+        await db_pool.close()
+
+# Shards are assigned in run_bot, so importing this module never depends on the shard settings
+bot = UploadLimitBot(command_prefix='!', intents=intents)
 
 # Scheduler setup
 scheduler = AsyncIOScheduler()
 
-async def reset_uploads():
+async def purge_stale_uploads(batch_size=1000):
+    # Counters reset implicitly when their period changes (see shared/periods.py);
+    # this only removes rows that have not been touched for longer than any window.
+    with JOB_SECONDS.labels('purge_stale_uploads').time():
+        await _purge_stale_uploads(batch_size)
+
+async def _purge_stale_uploads(batch_size):
     try:
-        est = pytz.timezone('US/Eastern')
-        current_time_est = datetime.datetime.now(est)
-        is_sunday_midnight = current_time_est.weekday() == 6 and current_time_est.hour == 0 and current_time_est.minute < 5
-
-        current_time = datetime.datetime.now().isoformat()
-        async with aiosqlite.connect('file_uploads.db') as db:
-            # Reset daily channels
-            cursor = await db.execute("""
-                UPDATE user_channel_uploads
-                SET uploads = 0,
-                    last_reset = ?
-                WHERE channel_id IN (
-                    SELECT channel_id FROM channel_settings
-                    WHERE reset_frequency = 'daily'
-                )
-                AND datetime(last_reset) < datetime('now', '-1 day')
-            """, (current_time,))
-            daily_rows_affected = cursor.rowcount
-
-            # Reset weekly channels on Sunday at midnight EST
-            if is_sunday_midnight:
+        cutoff = (datetime.datetime.now(datetime.timezone.utc) - periods.STALE_AFTER).isoformat()
+        rows_deleted = 0
+        while True:
+            async with db_pool.acquire('purge') as db:
                 cursor = await db.execute("""
-                    UPDATE user_channel_uploads
-                    SET uploads = 0,
-                        last_reset = ?
-                    WHERE channel_id IN (
-                        SELECT channel_id FROM channel_settings
-                        WHERE reset_frequency = 'weekly'
+                    DELETE FROM user_channel_uploads
+                    WHERE rowid IN (
+                        SELECT rowid FROM user_channel_uploads
+                        WHERE last_reset < ?
+                        LIMIT ?
                     )
-                """, (current_time_est.isoformat(),))
-                weekly_rows_affected = cursor.rowcount
-            else:
-                weekly_rows_affected = 0
-
-            await db.commit()
-        print(f"Daily upload counts reset at {current_time}. Daily rows affected: {daily_rows_affected}, Weekly rows affected: {weekly_rows_affected}")
-    except Exception as e:
-        print(f"Error in reset_uploads: {e}")
-
-async def send_private_message(channel, user, content):
+                """, (cutoff, batch_size))
+                await db.commit()
+            rows_deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+
+        if rows_deleted:
+            # Purged rows may have been among a channel's top uploaders
+            async with db_pool.acquire('purge') as db:
+                cursor = await db.execute("SELECT channel_id FROM channel_summary")
+                await refresh_top_uploaders(db, [row[0] for row in await cursor.fetchall()])
+                await db.commit()
+        log.info("Purged stale upload counters", extra={'fields': {'rows': rows_deleted, 'cutoff': cutoff}})
+    except Exception:
+        log.exception("Error in purge_stale_uploads")
+
+async def reset_role_counters(role_name, channel_ids=None):
+    """Reset the counters of every member holding ``role_name`` in the guilds this process serves.
+
+    Requested from the dashboard, which has no view of role membership.
+    Limited to ``channel_ids`` when given, otherwise every text channel of
+    the role's guild.
+    """
+    wanted = set(channel_ids) if channel_ids else None
     try:
-        await user.send(content)
-        print(f"Private message sent to {user.name}")
-    except discord.errors.Forbidden:
-        print(f"Unable to send DM to {user.name}. Sending in channel instead.")
-        await channel.send(f"{user.mention} {content}", delete_after=10)
-    except Exception as e:
-        print(f"Unexpected error in send_private_message: {e}")
-        await channel.send(f"{user.mention} {content}", delete_after=10)
-
-async def update_channel_names():
-    async with aiosqlite.connect('file_uploads.db') as db:
-        for guild in bot.guilds:
-            for channel in guild.text_channels:
-                await db.execute("""
-                    INSERT OR REPLACE INTO channel_names (channel_id, channel_name)
-                    VALUES (?, ?)
-                """, (channel.id, channel.name))
-        await db.commit()
-    print("Channel names updated.")
+        reset_channels = []
+        async with db_pool.acquire('reset_role') as db:
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS reset_channels (channel_id INTEGER PRIMARY KEY)")
+            for guild in bot.guilds:
+                user_ids = {member.id for role in guild.roles if role.name == role_name for member in role.members}
+                guild_channels = [channel.id for channel in guild.text_channels if wanted is None or channel.id in wanted]
+                if not user_ids or not guild_channels:
+                    continue
+                await db.execute("DELETE FROM reset_channels")
+                await db.executemany("INSERT INTO reset_channels (channel_id) VALUES (?)", [(cid,) for cid in guild_channels])
+                await db.executemany("""
+                    UPDATE user_channel_uploads
+                    SET uploads = 0, last_reset = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND channel_id IN (SELECT channel_id FROM reset_channels)
+                """, [(user_id,) for user_id in user_ids])
+                reset_channels.extend(guild_channels)
+            await refresh_top_uploaders(db, reset_channels)
+            await db.commit()
+        quota.invalidate_counters()
+        log.info("Reset upload counters for role", extra={'fields': {'role': role_name, 'channels': len(reset_channels)}})
+    except Exception:
+        log.exception("Error resetting counters for role", extra={'fields': {'role': role_name}})
+
+async def migrate_database():
+    async with db_pool.acquire('schema') as db:
+        version = await migrations.migrate(db)
+    log.info("Database schema migrated", extra={'fields': {'version': version}})
+
+async def warm_caches(guilds):
+    """Compile channel rules and load recently active counters before the first uploads need them."""
+    channels = [(channel.id, guild) for guild in guilds for channel in guild.text_channels]
+    started = time.perf_counter()
+    rules_warmed, counters_warmed = await asyncio.gather(
+        rule_index.warm(channels),
+        quota.warm(int(os.getenv('WARM_RECENT_EVENTS', 5000))))
+    log.info("Warmed caches", extra={'fields': {'channels': rules_warmed, 'counters': counters_warmed,
+                                                'seconds': round(time.perf_counter() - started, 2)}})
 
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
-
-    async with aiosqlite.connect('file_uploads.db') as db:
-        await db.execute('''CREATE TABLE IF NOT EXISTS user_channel_uploads
-                            (user_id INTEGER,
-                             channel_id INTEGER,
-                             username TEXT,
-                             uploads INTEGER,
-                             last_reset TEXT,
-                             PRIMARY KEY (user_id, channel_id))''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS channel_settings
-                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                             channel_id INTEGER,
-                             role_name TEXT,
-                             max_uploads INTEGER,
-                             order_index INTEGER)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS global_settings
-                            (id INTEGER PRIMARY KEY CHECK (id = 1),
-                             default_max_uploads INTEGER)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS blocked_channels
-                            (channel_id INTEGER PRIMARY KEY)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS channel_names
-                            (channel_id INTEGER PRIMARY KEY,
-                             channel_name TEXT)''')
-        # Check if reset_frequency column exists in channel_settings table
-        cursor = await db.execute("PRAGMA table_info(channel_settings)")
-        columns = await cursor.fetchall()
-        column_names = [column[1] for column in columns]
-
-        if 'reset_frequency' not in column_names:
-            # Add reset_frequency column if it doesn't exist
-            await db.execute('''ALTER TABLE channel_settings
-                                ADD COLUMN reset_frequency TEXT DEFAULT 'daily' ''')
-            print("Added reset_frequency column to channel_settings table")
-        else:
-            print("reset_frequency column already exists in channel_settings table")
+    log.info("Connected to Discord", extra={'fields': {'user': str(bot.user), 'shards': sorted(bot.shards),
+                                                      'shard_count': bot.shard_count, 'process': sharding.process_index()}})
+
+    # on_ready fires again whenever a shard needs a new session; only catching
+    # up on channel names missed while disconnected is repeated then
+    first_ready = not bot.ready_once
+    bot.ready_once = True
+    # Only a process running every shard sees every guild, so only it may delete missing channels
+    steps = [channel_sync.reconcile(bot.guilds, prune=len(bot.shards) == bot.shard_count)]
+    if first_ready:
+        steps.append(asyncio.wait_for(warm_caches(bot.guilds), timeout=float(os.getenv('WARM_TIMEOUT_SECONDS', 10))))
+    for result in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(result, asyncio.TimeoutError):
+            # Whatever was not warmed is compiled on first use
+            log.warning("Cache warm-up did not finish in time; continuing with partially warm caches")
+        elif isinstance(result, Exception):
+            log.error("Error during startup", exc_info=result)
 
-        await db.commit()
+@bot.event
+async def on_guild_channel_create(channel):
+    channel_sync.channel_changed(channel)
 
-    # Update channel names immediately
-    await update_channel_names()
+@bot.event
+async def on_guild_channel_update(before, after):
+    if before.name != after.name:
+        channel_sync.channel_changed(after)
 
-    # Reset uploads on launch
-    await reset_uploads()
+@bot.event
+async def on_guild_channel_delete(channel):
+    channel_sync.channel_removed(channel)
+    rule_index.invalidate(channel.id)
 
-    # Start the scheduler
-    scheduler.start()
-    print("Scheduler started")
+@bot.event
+async def on_guild_join(guild):
+    channel_sync.guild_added(guild)
 
-    # Schedule jobs after starting the scheduler
-    scheduler.add_job(reset_uploads, CronTrigger(minute='*/5'))
-    scheduler.add_job(update_channel_names, CronTrigger(hour='*/6'))
+@bot.event
+async def on_guild_remove(guild):
+    channel_sync.guild_removed(guild)
+    rule_index.invalidate_guild(guild.id)
+
+# Rules are compiled against role IDs, so role changes rebuild that guild's channels
+@bot.event
+async def on_guild_role_create(role):
+    rule_index.invalidate_guild(role.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        rule_index.invalidate_guild(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    rule_index.invalidate_guild(role.guild.id)
 
 @bot.event
 async def on_message(message):
@@ -168,115 +294,139 @@ async def on_message(message):
         user_id = message.author.id
         username = message.author.name
 
-        counted_attachments = [att for att in message.attachments if att.filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a', '.ogg'))]
+        with UPLOAD_PHASE_SECONDS.labels('classify').time():
+            verdicts = await classifier.classify(message.attachments)
+        counted_attachments = [(att, verdict) for att, verdict in zip(message.attachments, verdicts) if verdict.is_audio]
         if not counted_attachments:
             return await bot.process_commands(message)
 
-        async with aiosqlite.connect('file_uploads.db') as db:
+        with UPLOAD_PHASE_SECONDS.labels('total').time():
+            attachments_count = len(counted_attachments)
+            attachments_size = sum(att.size or 0 for att, _ in counted_attachments)
+            with UPLOAD_PHASE_SECONDS.labels('lookup').time():
+                rules = await rule_index.get(channel_id, message.guild)
+                # Determine max_uploads, reset_frequency and burst limit from the user's highest priority role
+                max_uploads, reset_frequency, user_burst = rule_index.resolve(rules, (role.id for role in message.author.roles))
+                period_id = periods.period_id(reset_frequency, rules.timezone)
+
             # Check if the channel is blocked
-            async with db.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)) as cursor:
-                is_blocked = await cursor.fetchone()
-
-            if is_blocked:
-                try:
-                    await message.delete()
-                    await send_private_message(message.channel, message.author,
-                        f"Your message was deleted because audio uploads are not allowed in this channel.")
-                    return
-                except discord.errors.NotFound:
-                    print(f"Message {message.id} was already deleted")
-                except discord.errors.Forbidden:
-                    print(f"Bot doesn't have permission to delete message {message.id}")
+            if rules.blocked:
+                upload_log.record(user_id, channel_id, attachments_count, attachments_size, 'blocked')
+                UPLOAD_DECISIONS_TOTAL.labels('blocked').inc()
+                await moderation.enqueue(message,
+                    "Your message was deleted because audio uploads are not allowed in this channel.")
+                return
+
+            # Files this user already uploaded here this window, recognised by content (needs CLASSIFIER_SNIFF_BYTES)
+            duplicates = [(att, verdict) for att, verdict in counted_attachments
+                          if verdict.digest and recent_uploads.get((user_id, channel_id, period_id, verdict.digest))]
+            if duplicates and DUPLICATE_UPLOAD_POLICY == 'reject':
+                upload_log.record(user_id, channel_id, attachments_count, attachments_size, 'duplicate')
+                UPLOAD_DECISIONS_TOTAL.labels('duplicate').inc()
+                await moderation.enqueue(message,
+                    "Your upload was deleted because you already uploaded the same file in this channel.")
+                return
+            if duplicates and DUPLICATE_UPLOAD_POLICY == 'skip':
+                # Re-posting a file already counted does not count again
+                counted_attachments = [item for item in counted_attachments if item not in duplicates]
+                if not counted_attachments:
+                    upload_log.record(user_id, channel_id, attachments_count, attachments_size, 'duplicate')
+                    UPLOAD_DECISIONS_TOTAL.labels('duplicate').inc()
+                    return await bot.process_commands(message)
+                attachments_count = len(counted_attachments)
+                attachments_size = sum(att.size or 0 for att, _ in counted_attachments)
+
+            with UPLOAD_PHASE_SECONDS.labels('decision').time():
+                # Short-term rate limit first, so a burst is rejected before it spends the period allowance
+                if not bursts.try_acquire(user_id, channel_id, attachments_count, user_burst, rules.channel_burst):
+                    upload_log.record(user_id, channel_id, attachments_count, attachments_size, 'rate_limited')
+                    UPLOAD_DECISIONS_TOTAL.labels('rate_limited').inc()
+                    await moderation.enqueue(message,
+                        "Your upload was deleted because you are uploading too quickly in this channel. "
+                        "Please wait a little before uploading again.",
+                        forbidden_notice="you are uploading too quickly in this channel. Please slow down.")
                     return
 
-            # Get channel settings
-            async with db.execute("SELECT role_name, max_uploads, reset_frequency FROM channel_settings WHERE channel_id = ? ORDER BY order_index", (channel_id,)) as cursor:
-                channel_settings = await cursor.fetchall()
-
-            # Get global settings
-            async with db.execute("SELECT default_max_uploads FROM global_settings WHERE id = 1") as cursor:
-                global_settings = await cursor.fetchone()
-
-            # Get user's roles
-            user_roles = [role.name for role in message.author.roles]
-
-            # Determine max_uploads and reset_frequency based on user's highest priority role
-            max_uploads = None
-            reset_frequency = 'daily'  # Default to daily if not set
-            for role_name, role_max_uploads, role_reset_frequency in channel_settings:
-                if role_name in user_roles:
-                    max_uploads = role_max_uploads
-                    reset_frequency = role_reset_frequency
-                    break  # Break after finding the highest priority role the user has
-
-            if max_uploads is None:
-                if global_settings:
-                    max_uploads = global_settings[0]
-                else:
+                if max_uploads is None:
                     # No settings found, allow unlimited uploads
+                    upload_log.record(user_id, channel_id, attachments_count, attachments_size, 'unlimited')
+                    UPLOAD_DECISIONS_TOTAL.labels('unlimited').inc()
                     return
 
-            # Check user's current upload count
-            async with db.execute("SELECT uploads, last_reset FROM user_channel_uploads WHERE user_id = ? AND channel_id = ?", (user_id, channel_id)) as cursor:
-                user_data = await cursor.fetchone()
-
-            current_uploads = user_data[0] if user_data else 0
-
+                # Check and record the upload against the user's count for the current window
+                allowed, current_uploads = await quota.try_consume(user_id, channel_id, username, attachments_count, max_uploads, period_id)
+                if not allowed:
+                    # The upload is deleted anyway; do not let it count against the burst allowance
+                    bursts.release(user_id, channel_id, attachments_count, user_burst, rules.channel_burst)
             remaining_uploads = max_uploads - current_uploads
-            attachments_count = len(counted_attachments)
-
-            if remaining_uploads >= attachments_count:
-                # All attachments allowed
-                new_upload_count = current_uploads + attachments_count
-                await db.execute("INSERT OR REPLACE INTO user_channel_uploads (user_id, channel_id, username, uploads, last_reset) VALUES (?, ?, ?, ?, ?)",
-                                 (user_id, channel_id, username, new_upload_count, current_time.isoformat()))
-                await db.commit()
-                print(f"Updated upload count for user {username} in channel {channel_id}: {new_upload_count}")
+            decision = 'allowed' if allowed else 'denied'
+            upload_log.record(user_id, channel_id, attachments_count, attachments_size, decision)
+            UPLOAD_DECISIONS_TOTAL.labels(decision).inc()
+
+            if allowed:
+                for _, verdict in counted_attachments:
+                    if verdict.digest:
+                        recent_uploads.set((user_id, channel_id, period_id, verdict.digest), True)
+                log.debug("Upload counted", extra={'fields': {
+                    'user_id': user_id, 'channel_id': channel_id, 'uploads': current_uploads + attachments_count}})
             else:
                 # Upload limit exceeded
-                try:
-                    await message.delete()
-                    await send_private_message(message.channel, message.author,
-                        f"Your upload was deleted as it would exceed your {reset_frequency} limit for this channel. "
-                        f"You have {remaining_uploads} uploads remaining out of {max_uploads} in this channel.")
-                except discord.errors.NotFound:
-                    print(f"Message {message.id} was already deleted")
-                except discord.errors.Forbidden:
-                    print(f"Bot doesn't have permission to delete message {message.id}")
-                    await message.channel.send(
-                        f"{message.author.mention}, your upload exceeds your {reset_frequency} limit for this channel. "
+                await moderation.enqueue(message,
+                    f"Your upload was deleted as it would exceed your {reset_frequency} limit for this channel. "
+                    f"You have {remaining_uploads} uploads remaining out of {max_uploads} in this channel.",
+                    forbidden_notice=
+                        f"your upload exceeds your {reset_frequency} limit for this channel. "
                         f"You have {remaining_uploads} uploads remaining out of {max_uploads} in this channel. "
                         f"Please delete this message and upload fewer files.")
                 return  # Stop processing this message
 
     await bot.process_commands(message)
 
+async def bump_settings_version(db, scope_id):
+    """``notify.bump_settings_version`` for an aiosqlite connection."""
+    await db.execute(notify.BUMP_SETTINGS_VERSION, (scope_id,))
+    async with db.execute("SELECT version FROM settings_versions WHERE scope_id = ?", (scope_id,)) as cursor:
+        return (await cursor.fetchone())[0]
+
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def set_channel_settings(ctx, channel_id: int, role_name: str, max_uploads: int, order_index: int):
-    async with aiosqlite.connect('file_uploads.db') as db:
+    async with db_pool.acquire('commands') as db:
         await db.execute("INSERT OR REPLACE INTO channel_settings (channel_id, role_name, max_uploads, order_index) VALUES (?, ?, ?, ?)",
                          (channel_id, role_name, max_uploads, order_index))
+        version = await bump_settings_version(db, channel_id)
         await db.commit()
+    # Same path as the dashboard, so the other shard processes drop their copy too
+    rule_index.invalidate(channel_id, version)
+    notify.publish('channel', channel_id=channel_id, version=version)
     await ctx.send(f"Channel settings updated for channel {channel_id}")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def set_global_limit(ctx, max_uploads: int):
-    async with aiosqlite.connect('file_uploads.db') as db:
+    async with db_pool.acquire('commands') as db:
         await db.execute("INSERT OR REPLACE INTO global_settings (id, default_max_uploads) VALUES (1, ?)", (max_uploads,))
+        version = await bump_settings_version(db, notify.GLOBAL_SCOPE)
         await db.commit()
+    rule_index.invalidate_global(version)
+    notify.publish('global', version=version)
     await ctx.send(f"Global upload limit set to {max_uploads}")
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def moderation_stats(ctx):
+    stats = moderation.stats()
+    await ctx.send(f"Moderation queue depth: {stats['depth']}, processed: {stats['processed']}, "
+                   f"bulk deletes: {stats['bulk_deletes']}, coalesced notices: {stats['coalesced_notices']}, "
+                   f"latency p50/max: {stats['latency_p50']:.2f}s/{stats['latency_max']:.2f}s")
+
 @bot.command()
 async def check_uploads(ctx):
     user_id = ctx.author.id
     channel_id = ctx.channel.id
-    async with aiosqlite.connect('file_uploads.db') as db:
-        async with db.execute("SELECT uploads FROM user_channel_uploads WHERE user_id = ? AND channel_id = ?", (user_id, channel_id)) as cursor:
-            user_uploads = await cursor.fetchone()
-
-    current_uploads = user_uploads[0] if user_uploads else 0
+    rules = await rule_index.get(channel_id, ctx.guild)
+    _, reset_frequency, _ = rule_index.resolve(rules, (role.id for role in getattr(ctx.author, 'roles', ())))
+    current_uploads = await quota.get_uploads(user_id, channel_id, periods.period_id(reset_frequency, rules.timezone))
     await ctx.send(f"{ctx.author.mention}, you have used {current_uploads} uploads in this channel.")
 
 def run_bot():
@@ -285,12 +435,15 @@ def run_bot():
     if not token:
         print("ERROR: DISCORD_BOT_TOKEN not found in environment variables.")
         return
+    try:
+        # Shards come from SHARD_COUNT/SHARD_IDS/SHARD_PROCESSES (see bot/sharding.py)
+        bot.shard_count, bot.shard_ids = sharding.shard_settings()
+    except ValueError as e:
+        print(f"ERROR: Invalid shard settings: {e}")
+        return
     try:
         bot.run(token)
     except discord.errors.LoginFailure as e:
         print(f"ERROR: Failed to log in: {e}")
     except Exception as e:
         print(f"ERROR: An unexpected error occurred: {e}")
-
-if __name__ == "__main__":
-    run_bot()
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+def _digest(names):
+    content = "\n".join(f"{channel_id}:{name}" for channel_id, name in sorted(names.items()))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class ChannelNameSync:
+    """Keeps channel_names in step with Discord by writing only what changed.
+
+    Gateway events queue upserts and deletions, which are written together in
+    a single executemany transaction shortly after the last event. A full
+    comparison only happens in ``reconcile`` at startup.
+    """
+
+    def __init__(self, db_pool, flush_delay=1.0):
+        self.db_pool = db_pool
+        self.flush_delay = flush_delay
+        self._known = {}
+        self._upserts = {}
+        self._deletes = set()
+        self._flush_handle = None
+        self._running = set()
+
+    async def reconcile(self, guilds, prune=True):
+        """Write the differences between channel_names and the channels of ``guilds``.
+
+        With ``prune``, rows of channels missing from ``guilds`` are deleted;
+        pass False when ``guilds`` covers only part of the table, as in a
+        process running some of the shards.
+        """
+        current = {channel.id: channel.name for guild in guilds for channel in guild.text_channels}
+        if any(getattr(guild, 'unavailable', False) for guild in guilds):
+            # An outage hides a guild's channels; they are not gone
+            prune = False
+
+        async with self.db_pool.acquire('channel_names_load') as db:
+            async with db.execute("SELECT channel_id, channel_name FROM channel_names") as cursor:
+                stored = dict(await cursor.fetchall())
+
+        self._known = stored
+        compared = stored if prune else {cid: stored.get(cid) for cid in current}
+        if _digest(compared) == _digest(current):
+            log.info("Channel names already up to date")
+            return 0
+
+        for channel_id, name in current.items():
+            if stored.get(channel_id) != name:
+                self._upserts[channel_id] = name
+        if prune:
+            # Channels deleted, or guilds left, while the bot was not connected
+            self._deletes.update(channel_id for channel_id in stored if channel_id not in current)
+        return await self.flush()
+
+    def channel_changed(self, channel):
+        if not isinstance(channel, discord.TextChannel) or self._known.get(channel.id) == channel.name:
+            return
+        self._deletes.discard(channel.id)
+        self._upserts[channel.id] = channel.name
+        self._schedule_flush()
+
+    def channel_removed(self, channel):
+        if channel.id not in self._known and channel.id not in self._upserts:
+            return
+        self._upserts.pop(channel.id, None)
+        self._deletes.add(channel.id)
+        self._schedule_flush()
+
+    def guild_added(self, guild):
+        for channel in guild.text_channels:
+            self.channel_changed(channel)
+
+    def guild_removed(self, guild):
+        for channel in guild.text_channels:
+            self.channel_removed(channel)
+
+    def _schedule_flush(self):
+        # Debounce bursts such as joining a large guild into one write
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        # The event loop only keeps weak references to tasks; hold this one until it is done
+        task = asyncio.create_task(self._flush_later())
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _flush_later(self):
+        self._flush_handle = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Error syncing channel names")
+
+    async def flush(self):
+        upserts, self._upserts = self._upserts, {}
+        deletes, self._deletes = self._deletes, set()
+        if not upserts and not deletes:
+            return 0
+
+        try:
+            async with self.db_pool.acquire('channel_names_sync') as db:
+                if upserts:
+                    await db.executemany("""
+                        INSERT INTO channel_names (channel_id, channel_name) VALUES (?, ?)
+                        ON CONFLICT(channel_id) DO UPDATE SET channel_name = excluded.channel_name
+                    """, list(upserts.items()))
+                if deletes:
+                    await db.executemany("DELETE FROM channel_names WHERE channel_id = ?",
+                                         [(channel_id,) for channel_id in deletes])
+                await db.commit()
+        except Exception:
+            # Keep the diff for the next flush unless newer events replaced it
+            for channel_id, name in upserts.items():
+                if channel_id not in self._deletes:
+                    self._upserts.setdefault(channel_id, name)
+            for channel_id in deletes:
+                if channel_id not in self._upserts:
+                    self._deletes.add(channel_id)
+            raise
+
+        self._known.update(upserts)
+        for channel_id in deletes:
+            self._known.pop(channel_id, None)
+        log.info("Channel names synced", extra={'fields': {'updated': len(upserts), 'removed': len(deletes)}})
+        return len(upserts) + len(deletes)
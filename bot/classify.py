@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from shared.cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+
+# Declared types that say nothing about the content
+GENERIC_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+
+def _mp3(head):
+    if head.startswith(b'ID3'):
+        return 'mp3'
+    # MPEG audio frame sync: 11 set bits
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return 'mp3'
+
+
+def _riff(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+
+
+def _flac(head):
+    if head.startswith(b'fLaC'):
+        return 'flac'
+
+
+def _ogg(head):
+    # Ogg can carry video too; only count streams that start with an audio codec header
+    if head.startswith(b'OggS') and (b'OpusHead' in head[:64] or b'\x01vorbis' in head[:64] or b'\x7fFLAC' in head[:64]):
+        return 'ogg'
+
+
+def _m4a(head):
+    if head[4:8] == b'ftyp' and head[8:12] in (b'M4A ', b'M4B ', b'M4P ', b'F4A '):
+        return 'm4a'
+
+
+def _aiff(head):
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+
+
+# Each detector takes the first bytes of a file and returns an audio format name or None
+MAGIC_DETECTORS = (_mp3, _riff, _flac, _ogg, _m4a, _aiff)
+
+
+class Verdict:
+    __slots__ = ('is_audio', 'kind', 'digest', 'source')
+
+    def __init__(self, is_audio, kind=None, digest=None, source=None):
+        self.is_audio = is_audio
+        self.kind = kind
+        # Identifies the file for duplicate checks: size plus a hash of the sniffed
+        # bytes, or the declared_key when the content was not read; None without sniffing
+        self.digest = digest
+        # 'content_type', 'extension', 'magic' or 'cache'
+        self.source = source
+
+
+def _content_type(attachment):
+    return (getattr(attachment, 'content_type', None) or '').split(';')[0].strip().lower()
+
+
+def declared_verdict(attachment):
+    """Classify from what Discord reports: content_type first, the filename when it is missing."""
+    content_type = _content_type(attachment)
+    if content_type and content_type not in GENERIC_CONTENT_TYPES:
+        return Verdict(content_type.startswith('audio/') or content_type == 'application/ogg',
+                       content_type, source='content_type')
+    return Verdict(attachment.filename.lower().endswith(AUDIO_EXTENSIONS), source='extension')
+
+
+def declared_key(attachment):
+    """What Discord reports about a file, which is the same every time the file is uploaded."""
+    return (attachment.size or 0, _content_type(attachment), attachment.filename.lower())
+
+
+def is_ambiguous(attachment, declared):
+    """Whether ``declared`` needs the content to confirm it.
+
+    That is when there was no usable content type, or when the content type
+    and the extension disagree about the file being audio, as with a renamed
+    file.
+    """
+    if declared.source == 'extension':
+        return True
+    return declared.is_audio != attachment.filename.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def content_digest(size, head):
+    return f"{size}:{hashlib.blake2b(head, digest_size=16).hexdigest()}"
+
+
+def detect(head, detectors=MAGIC_DETECTORS):
+    """Return the audio format the bytes start with, or None."""
+    for detector in detectors:
+        kind = detector(head)
+        if kind:
+            return kind
+    return None
+
+
+class AttachmentClassifier:
+    """Decides which attachments are audio.
+
+    Without sniffing, the declared content type (or the extension when there
+    is none) decides. With ``sniff_bytes`` set, attachments whose declared
+    verdict is ambiguous (see is_ambiguous) have their first bytes fetched
+    with a ranged request and matched against ``detectors`` in a thread pool,
+    so renamed files are still recognised. Those verdicts are cached by
+    declared_key and checked before fetching, so repeat uploads of the same
+    file are not fetched again. A failed fetch falls back to the declared
+    verdict.
+    """
+
+    def __init__(self, sniff_bytes=0, workers=2, cache_size=4096, cache_ttl=86400.0,
+                 detectors=MAGIC_DETECTORS, fetch_timeout=5.0):
+        self.sniff_bytes = sniff_bytes
+        self.detectors = detectors
+        self.fetch_timeout = fetch_timeout
+        self.workers = workers
+        self._verdicts = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._executor = None
+        self._session = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(sniff_bytes=int(os.getenv('CLASSIFIER_SNIFF_BYTES', 0)),
+                   workers=int(os.getenv('CLASSIFIER_WORKERS', 2)))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def classify(self, attachments):
+        """Return one Verdict per attachment, in order."""
+        if not self.sniff_bytes:
+            return [declared_verdict(attachment) for attachment in attachments]
+        return await asyncio.gather(*(self._sniff(attachment) for attachment in attachments))
+
+    async def _fetch_head(self, url, size):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.fetch_timeout))
+        length = min(self.sniff_bytes, size) if size else self.sniff_bytes
+        headers = {'Range': f'bytes=0-{length - 1}'}
+        async with self._session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            # read() returns whatever is buffered; the digest needs the same bytes every time.
+            # Servers that ignore Range send the whole file, so stop after the head.
+            try:
+                return await response.content.readexactly(length)
+            except asyncio.IncompleteReadError as e:
+                # Shorter than Discord reported
+                return e.partial
+
+    async def _sniff(self, attachment):
+        key = declared_key(attachment)
+        cached = self._verdicts.get(key)
+        if cached is not None:
+            return Verdict(cached.is_audio, cached.kind, cached.digest, 'cache')
+
+        declared = declared_verdict(attachment)
+        if not is_ambiguous(attachment, declared):
+            declared.digest = key
+            return declared
+        try:
+            head = await self._fetch_head(attachment.url, attachment.size)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Unable to read attachment for classification",
+                        extra={'fields': {'attachment_id': attachment.id, 'error': str(e)}})
+            return declared
+
+        # Hashing a few KB is cheap enough for the event loop; matching runs in the pool
+        digest = content_digest(attachment.size or 0, head)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='classify')
+        kind = await asyncio.get_running_loop().run_in_executor(self._executor, detect, head, self.detectors)
+        if kind:
+            verdict = Verdict(True, kind, digest, 'magic')
+        else:
+            # Formats without a detector keep the type Discord reported
+            verdict = Verdict(declared.is_audio and declared.source == 'content_type', declared.kind, digest, 'magic')
+        self._verdicts.set(key, verdict)
+        return verdict
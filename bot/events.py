@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS upload_events
+       (id INTEGER PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        attachments INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        decision TEXT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS upload_rollups_hourly
+       (bucket TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        decision TEXT NOT NULL,
+        events INTEGER NOT NULL,
+        attachments INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        PRIMARY KEY (bucket, channel_id, decision))''',
+    '''CREATE TABLE IF NOT EXISTS upload_rollups_daily
+       (bucket TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        decision TEXT NOT NULL,
+        events INTEGER NOT NULL,
+        attachments INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        PRIMARY KEY (bucket, channel_id, decision))''',
+]
+
+# Buckets are UTC; hourly keys sort and compare as plain strings
+HOURLY_FORMAT = '%Y-%m-%dT%H:00'
+DAILY_FORMAT = '%Y-%m-%d'
+
+_ROLLUP_UPSERT = '''
+    INSERT INTO {table} (bucket, channel_id, decision, events, attachments, bytes)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(bucket, channel_id, decision) DO UPDATE SET
+        events = events + excluded.events,
+        attachments = attachments + excluded.attachments,
+        bytes = bytes + excluded.bytes
+'''
+
+
+class UploadEventLog:
+    """Append-only record of upload decisions, written in batches.
+
+    Each flush inserts the buffered events and folds them into the hourly
+    and daily rollup tables in the same transaction, so the rollups never
+    have to be rebuilt from the raw log.
+    """
+
+    def __init__(self, db_pool, flush_interval=10.0, flush_threshold=500):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._flush_task = None
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def record(self, user_id, channel_id, attachments, size, decision):
+        self._buffer.append((datetime.datetime.now(datetime.timezone.utc), user_id, channel_id, attachments, size, decision))
+        if len(self._buffer) >= self.flush_threshold:
+            self._flush_wakeup.set()
+
+    @staticmethod
+    def _rollup(events, bucket_format):
+        totals = {}
+        for created_at, _, channel_id, attachments, size, decision in events:
+            key = (created_at.strftime(bucket_format), channel_id, decision)
+            total = totals.setdefault(key, [0, 0, 0])
+            total[0] += 1
+            total[1] += attachments
+            total[2] += size
+        return [key + tuple(total) for key, total in totals.items()]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            events, self._buffer = self._buffer, []
+            try:
+                async with self.db_pool.acquire('upload_events_flush') as db:
+                    await db.executemany("""
+                        INSERT INTO upload_events (created_at, user_id, channel_id, attachments, bytes, decision)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, [(created_at.isoformat(),) + tuple(rest) for created_at, *rest in events])
+                    await db.executemany(_ROLLUP_UPSERT.format(table='upload_rollups_hourly'),
+                                         self._rollup(events, HOURLY_FORMAT))
+                    await db.executemany(_ROLLUP_UPSERT.format(table='upload_rollups_daily'),
+                                         self._rollup(events, DAILY_FORMAT))
+                    await db.commit()
+            except Exception:
+                self._buffer[:0] = events
+                raise
+            return len(events)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Error flushing upload events")
@@ -0,0 +1,39 @@
+import os
+
+from aiohttp import web
+
+from shared.metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
+
+UPLOAD_PHASE_SECONDS = Histogram(
+    'upload_phase_seconds', 'Time spent handling uploads, by phase (classify, lookup, decision, delete, dm, total)', ['phase'])
+UPLOAD_DECISIONS_TOTAL = Counter(
+    'upload_decisions_total', 'Audio upload messages by decision', ['decision'])
+MODERATION_QUEUE_DEPTH = Gauge(
+    'moderation_queue_depth', 'Moderation actions waiting to be processed')
+MODERATION_LATENCY_SECONDS = Histogram(
+    'moderation_action_latency_seconds', 'Time from queueing a moderation action to finishing it')
+JOB_SECONDS = Histogram(
+    'scheduler_job_seconds', 'Run time of scheduled jobs', ['job'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+
+async def _metrics(request):
+    return web.Response(body=REGISTRY.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_metrics_server(offset=0):
+    """Serve /metrics on METRICS_ADDR (default 127.0.0.1:9101); an empty value disables it.
+
+    Sharded bot processes each listen ``offset`` ports above the configured one.
+    """
+    address = os.getenv('METRICS_ADDR', '127.0.0.1:9101')
+    if not address:
+        return None
+    host, _, port = address.rpartition(':')
+    port = int(port) + offset
+    app = web.Application()
+    app.router.add_get('/metrics', _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,136 @@
+import logging
+
+from bot import events
+from bot.quota import refresh_top_uploaders
+from shared import summary
+
+log = logging.getLogger(__name__)
+
+
+async def add_column_if_missing(db, table, column, definition):
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    column_names = [row[1] for row in await cursor.fetchall()]
+    if column not in column_names:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        log.info("Added column", extra={'fields': {'table': table, 'column': column}})
+
+
+# Databases created before versioning already have some of these changes, so
+# every step is written to be safe to run against them.
+
+async def _create_tables(db):
+    await db.execute('''CREATE TABLE IF NOT EXISTS user_channel_uploads
+                        (user_id INTEGER,
+                         channel_id INTEGER,
+                         username TEXT,
+                         uploads INTEGER,
+                         last_reset TEXT,
+                         PRIMARY KEY (user_id, channel_id))''')
+    await db.execute('''CREATE TABLE IF NOT EXISTS channel_settings
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         channel_id INTEGER,
+                         role_name TEXT,
+                         max_uploads INTEGER,
+                         order_index INTEGER)''')
+    await db.execute('''CREATE TABLE IF NOT EXISTS global_settings
+                        (id INTEGER PRIMARY KEY CHECK (id = 1),
+                         default_max_uploads INTEGER)''')
+    await db.execute('''CREATE TABLE IF NOT EXISTS blocked_channels
+                        (channel_id INTEGER PRIMARY KEY)''')
+    await db.execute('''CREATE TABLE IF NOT EXISTS channel_names
+                        (channel_id INTEGER PRIMARY KEY,
+                         channel_name TEXT)''')
+    await db.execute('''CREATE TABLE IF NOT EXISTS settings_versions
+                        (scope_id INTEGER PRIMARY KEY,
+                         version INTEGER NOT NULL)''')
+
+
+async def _add_reset_windows(db):
+    await add_column_if_missing(db, 'channel_settings', 'reset_frequency', "TEXT DEFAULT 'daily'")
+    await add_column_if_missing(db, 'channel_settings', 'timezone', 'TEXT')
+    await add_column_if_missing(db, 'user_channel_uploads', 'period_id', 'TEXT')
+
+
+async def _add_counter_indexes(db):
+    # Supports the batched purge of stale counters
+    await db.execute('''CREATE INDEX IF NOT EXISTS idx_user_channel_uploads_last_reset
+                        ON user_channel_uploads (last_reset)''')
+    # Support the dashboard's channel and username filters on the users list
+    await db.execute('''CREATE INDEX IF NOT EXISTS idx_user_channel_uploads_channel
+                        ON user_channel_uploads (channel_id, user_id)''')
+    await db.execute('''CREATE INDEX IF NOT EXISTS idx_user_channel_uploads_username
+                        ON user_channel_uploads (username)''')
+
+
+async def _create_upload_events(db):
+    for statement in events.SCHEMA:
+        await db.execute(statement)
+
+
+async def _create_channel_summary(db):
+    # Materialized per-channel summary for the dashboard's overview page
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'channel_summary'")
+    summary_exists = await cursor.fetchone() is not None
+    for statement in summary.SCHEMA + summary.TRIGGERS:
+        await db.execute(statement)
+    if not summary_exists:
+        await db.execute(summary.BACKFILL)
+        cursor = await db.execute("SELECT channel_id FROM channel_summary")
+        await refresh_top_uploaders(db, [row[0] for row in await cursor.fetchall()])
+        log.info("Created channel_summary table")
+
+
+async def _add_burst_limits(db):
+    # Token-bucket burst limits: per role rule for each user, and channel-wide
+    await add_column_if_missing(db, 'channel_settings', 'burst_size', 'INTEGER')
+    await add_column_if_missing(db, 'channel_settings', 'refill_per_minute', 'REAL')
+    await add_column_if_missing(db, 'channel_settings', 'channel_burst_size', 'INTEGER')
+    await add_column_if_missing(db, 'channel_settings', 'channel_refill_per_minute', 'REAL')
+
+
+async def _create_bulk_jobs(db):
+    # Status of the dashboard's background bulk jobs, polled by the client that started them
+    await db.execute('''CREATE TABLE IF NOT EXISTS bulk_jobs
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         kind TEXT NOT NULL,
+                         status TEXT NOT NULL,
+                         total_rows INTEGER NOT NULL,
+                         result TEXT,
+                         error TEXT,
+                         created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                         finished_at TEXT)''')
+
+
+# Schema history; PRAGMA user_version records how many of these have been applied.
+# Only ever append: a released step must not change.
+MIGRATIONS = (
+    _create_tables,
+    _add_reset_windows,
+    _add_counter_indexes,
+    _create_upload_events,
+    _create_channel_summary,
+    _add_burst_limits,
+    _create_bulk_jobs,
+)
+
+
+async def migrate(db, migrations=MIGRATIONS):
+    """Apply the migrations the database has not seen yet; returns its schema version.
+
+    Everything runs in one IMMEDIATE transaction, so shard processes
+    starting together wait for each other and only the first applies
+    anything, and a failed step leaves the schema as it was.
+    """
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            log.info("Applied schema migration", extra={'fields': {'version': number, 'name': migration.__name__.lstrip('_')}})
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    return max(version, len(migrations))
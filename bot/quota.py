@@ -0,0 +1,371 @@
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import time
+
+from shared import summary
+
+log = logging.getLogger(__name__)
+
+# Backends selectable with QUOTA_BACKEND
+BACKENDS = ('memory', 'sqlite')
+
+
+async def refresh_top_uploaders(db, channel_ids):
+    # Write hook for channel_summary; uses idx_user_channel_uploads_top
+    for channel_id in channel_ids:
+        async with db.execute(summary.TOP_UPLOADERS_QUERY, (channel_id, summary.TOP_UPLOADERS_LIMIT)) as cursor:
+            rows = await cursor.fetchall()
+        await db.execute(summary.UPDATE_TOP_UPLOADERS, (channel_id, summary.encode_top_uploaders(rows)))
+
+
+def create_quota(db_pool, backend=None, processes=1):
+    """Build the quota backend named by ``backend`` or QUOTA_BACKEND.
+
+    The in-memory engine is only correct while a single process decides for
+    each (user, channel), so the shared SQLite store is the default as soon as
+    more than one bot process runs.
+    """
+    backend = backend or os.getenv('QUOTA_BACKEND') or ('memory' if processes <= 1 else 'sqlite')
+    if backend == 'memory':
+        return QuotaEngine(db_pool)
+    if backend == 'sqlite':
+        return SharedQuotaStore(db_pool)
+    raise ValueError(f"Unknown QUOTA_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+class QuotaEngine:
+    """Answers upload allow/deny decisions from memory.
+
+    Per-(user, channel) counters are loaded on first use and belong to a
+    period (see shared/periods.py); a counter from an earlier period reads as
+    zero, so there is nothing to reset. Accepted uploads
+    are recorded as pending deltas and written to SQLite in batched
+    transactions, either every ``flush_interval`` seconds or as soon as
+    ``flush_threshold`` keys are dirty. Counters older than ``counter_ttl``
+    are dropped on the same schedule, so memory follows the active users.
+    """
+
+    def __init__(self, db_pool, flush_interval=5.0, flush_threshold=50, counter_ttl=60.0):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.counter_ttl = counter_ttl
+
+        # (user_id, channel_id) -> [uploads, loaded_at, period_id]; uploads includes pending deltas.
+        # Kept in loaded_at order, oldest first, for evict_expired
+        self._counters = collections.OrderedDict()
+        # (user_id, channel_id, period_id) -> [username, delta, last_seen], in insertion order so
+        # a delta left over from an earlier period is written before the next period's
+        self._pending = {}
+
+        self._flush_lock = asyncio.Lock()
+        self._flush_wakeup = asyncio.Event()
+        self._flush_task = None
+        # Bumped whenever a flush takes pending deltas out of memory or puts them back
+        self._flush_generation = 0
+        # Connection of the flush in progress; it sees the batch from its first statement on
+        self._flush_db = None
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    # Counters
+
+    async def get_uploads(self, user_id, channel_id, period_id):
+        key = (user_id, channel_id)
+        entry = self._counters.get(key)
+        if entry is not None and time.monotonic() - entry[1] <= self.counter_ttl:
+            return entry[0] if entry[2] == period_id else 0
+
+        while True:
+            generation = self._flush_generation
+            row = await self._load_row(key)
+            if generation == self._flush_generation:
+                break
+            # A flush took this key's delta out of _pending while the row was being read
+            # on another connection, which may not include it yet; read again
+
+        uploads = row[0] if row and row[1] == period_id else 0
+        pending = self._pending.get((user_id, channel_id, period_id))
+        if pending is not None:
+            uploads += pending[1]
+        self._counters[key] = [uploads, time.monotonic(), period_id]
+        self._counters.move_to_end(key)
+        return uploads
+
+    async def _load_row(self, key):
+        if self._flush_db is not None:
+            # While a batch is being written, read through the flush's own connection: its
+            # statements run in order, so this sees the batch whether or not it has committed,
+            # without waiting for the rest of the flush
+            return await self._select_row(self._flush_db, key)
+        async with self.db_pool.acquire('quota_load') as db:
+            return await self._select_row(db, key)
+
+    @staticmethod
+    async def _select_row(db, key):
+        async with db.execute("SELECT uploads, period_id FROM user_channel_uploads WHERE user_id = ? AND channel_id = ?", key) as cursor:
+            return await cursor.fetchone()
+
+    async def try_consume(self, user_id, channel_id, username, count, max_uploads, period_id):
+        """Record ``count`` uploads in ``period_id`` if they fit under ``max_uploads``.
+
+        Returns ``(allowed, uploads)`` where ``uploads`` is the count before
+        this message. The check and the increment happen without yielding to
+        the event loop, so concurrent messages cannot both pass the check.
+        """
+        key = (user_id, channel_id)
+        current_uploads = await self.get_uploads(user_id, channel_id, period_id)
+        if max_uploads - current_uploads < count:
+            return False, current_uploads
+
+        entry = self._counters[key]
+        entry[0] = current_uploads + count
+        entry[2] = period_id
+        pending = self._pending.get((user_id, channel_id, period_id))
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        if pending is None:
+            self._pending[(user_id, channel_id, period_id)] = [username, count, now]
+        else:
+            pending[0] = username
+            pending[1] += count
+            pending[2] = now
+
+        if len(self._pending) >= self.flush_threshold:
+            self._flush_wakeup.set()
+        return True, current_uploads
+
+    async def warm(self, recent_events=5000):
+        """Load the counters of the (user, channel) pairs behind the latest ``recent_events`` upload events.
+
+        Counters that handlers loaded in the meantime are newer and kept.
+        """
+        flushing = self._flush_lock.locked()
+        generation = self._flush_generation
+        async with self.db_pool.acquire('quota_warm') as db:
+            async with db.execute("""
+                SELECT u.user_id, u.channel_id, u.uploads, u.period_id
+                FROM (SELECT DISTINCT user_id, channel_id
+                      FROM (SELECT user_id, channel_id FROM upload_events ORDER BY id DESC LIMIT ?)) e
+                JOIN user_channel_uploads u ON u.user_id = e.user_id AND u.channel_id = e.channel_id
+            """, (recent_events,)) as cursor:
+                rows = await cursor.fetchall()
+        if flushing or generation != self._flush_generation:
+            # Rows read around a flush may miss deltas that left _pending; let handlers load them
+            return 0
+        loaded_at = time.monotonic()
+        pending_keys = {(user_id, channel_id) for user_id, channel_id, _ in self._pending}
+        warmed = 0
+        for user_id, channel_id, uploads, period_id in rows:
+            key = (user_id, channel_id)
+            if key not in self._counters and key not in pending_keys:
+                self._counters[key] = [uploads, loaded_at, period_id]
+                warmed += 1
+        return warmed
+
+    def evict_expired(self):
+        """Drop counters older than ``counter_ttl``; they would be reloaded on their next use anyway."""
+        cutoff = time.monotonic() - self.counter_ttl
+        evicted = 0
+        while self._counters:
+            key, entry = next(iter(self._counters.items()))
+            if entry[1] > cutoff:
+                break
+            del self._counters[key]
+            evicted += 1
+        return evicted
+
+    def invalidate_counter(self, user_id, channel_id):
+        self._counters.pop((user_id, channel_id), None)
+
+    def invalidate_counters(self):
+        self._counters.clear()
+
+    # Write-behind persistence
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch = rows = None
+            try:
+                async with self.db_pool.acquire('quota_flush') as db:
+                    # Take the batch and queue its first statement without yielding in between,
+                    # so a counter load finds the deltas in _pending or through _flush_db
+                    batch, self._pending = self._pending, {}
+                    self._flush_generation += 1
+                    self._flush_db = db
+                    rows = [(user_id, channel_id, username, delta, last_seen, period_id)
+                            for (user_id, channel_id, period_id), (username, delta, last_seen) in batch.items()]
+                    try:
+                        await db.executemany("""
+                            INSERT INTO user_channel_uploads (user_id, channel_id, username, uploads, last_reset, period_id)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(user_id, channel_id) DO UPDATE SET
+                                username = excluded.username,
+                                uploads = CASE WHEN period_id IS excluded.period_id
+                                               THEN uploads + excluded.uploads
+                                               ELSE excluded.uploads END,
+                                last_reset = CASE WHEN period_id IS excluded.period_id
+                                                  THEN last_reset
+                                                  ELSE excluded.last_reset END,
+                                period_id = excluded.period_id
+                        """, rows)
+                        await refresh_top_uploaders(db, {channel_id for _, channel_id, _ in batch})
+                        await db.commit()
+                    finally:
+                        self._flush_db = None
+            except Exception:
+                if batch is not None:
+                    # Put the batch back, ahead of newer deltas, so it is retried on the next flush
+                    for key, (username, delta, last_seen) in self._pending.items():
+                        pending = batch.get(key)
+                        if pending is None:
+                            batch[key] = [username, delta, last_seen]
+                        else:
+                            pending[0] = username
+                            pending[1] += delta
+                            pending[2] = last_seen
+                    self._pending = batch
+                    # Loads that read the rolled back batch must read again
+                    self._flush_generation += 1
+                raise
+            return len(rows)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            self.evict_expired()
+            try:
+                # Shielded so close() cannot cancel a batch half-way and lose its deltas
+                await asyncio.shield(self.flush())
+            except Exception:
+                log.exception("Error flushing upload counters")
+
+
+# Records an upload only if it fits: new rows need count <= max_uploads, existing rows
+# need their count for this period plus the upload to fit. Counters from an earlier
+# period count as zero and restart at this upload. Returns the new count, or no row.
+CONSUME_UPSERT = """
+    INSERT INTO user_channel_uploads (user_id, channel_id, username, uploads, last_reset, period_id)
+    SELECT ?, ?, ?, ?, ?, ? WHERE ? <= ?
+    ON CONFLICT(user_id, channel_id) DO UPDATE SET
+        username = excluded.username,
+        uploads = CASE WHEN period_id IS excluded.period_id
+                       THEN uploads + excluded.uploads
+                       ELSE excluded.uploads END,
+        last_reset = CASE WHEN period_id IS excluded.period_id
+                          THEN last_reset
+                          ELSE excluded.last_reset END,
+        period_id = excluded.period_id
+    WHERE CASE WHEN period_id IS excluded.period_id THEN uploads ELSE 0 END + excluded.uploads <= ?
+    RETURNING uploads
+"""
+
+
+class SharedQuotaStore:
+    """Quota decisions made directly in SQLite, shared by every bot process.
+
+    Each decision is one conditional upsert (CONSUME_UPSERT), so SQLite's
+    write lock serialises check-and-increment across processes; WAL mode
+    keeps dashboard reads running meanwhile. Nothing is cached, so there is nothing
+    to invalidate. Top uploaders for channels that took uploads are refreshed
+    every ``flush_interval`` seconds rather than on every message.
+    """
+
+    def __init__(self, db_pool, flush_interval=5.0):
+        self.db_pool = db_pool
+        self.flush_interval = flush_interval
+        self._dirty_channels = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def get_uploads(self, user_id, channel_id, period_id):
+        async with self.db_pool.acquire('quota_load') as db:
+            async with db.execute("SELECT uploads, period_id FROM user_channel_uploads WHERE user_id = ? AND channel_id = ?",
+                                  (user_id, channel_id)) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row and row[1] == period_id else 0
+
+    async def try_consume(self, user_id, channel_id, username, count, max_uploads, period_id):
+        """Same contract as QuotaEngine.try_consume, atomic across processes.
+
+        The check and the increment are a single conditional upsert, so an
+        accepted upload costs one statement and concurrent writers cannot
+        both pass the check.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        async with self.db_pool.acquire('quota_consume') as db:
+            async with db.execute(CONSUME_UPSERT, (user_id, channel_id, username, count, now, period_id,
+                                                   count, max_uploads, max_uploads)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                await db.commit()
+        if row is not None:
+            self._dirty_channels.add(channel_id)
+            return True, row[0] - count
+        # Denied; the count is only reported back to the user
+        return False, await self.get_uploads(user_id, channel_id, period_id)
+
+    async def warm(self, recent_events=5000):
+        return 0
+
+    def invalidate_counter(self, user_id, channel_id):
+        pass
+
+    def invalidate_counters(self):
+        pass
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty_channels:
+                return 0
+            channel_ids, self._dirty_channels = self._dirty_channels, set()
+            try:
+                async with self.db_pool.acquire('quota_flush') as db:
+                    await refresh_top_uploaders(db, channel_ids)
+                    await db.commit()
+            except Exception:
+                self._dirty_channels |= channel_ids
+                raise
+            return len(channel_ids)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.shield(self.flush())
+            except Exception:
+                log.exception("Error refreshing top uploaders")
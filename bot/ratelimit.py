@@ -0,0 +1,163 @@
+import array
+import asyncio
+import time
+
+
+class TokenBuckets:
+    """Token buckets for many keys, stored in flat arrays.
+
+    Each bucket is a slot holding its token count, the time it was last
+    updated and the time it will be full again; a dict maps keys to slots.
+    Refill happens lazily when a bucket is touched, using the burst size and
+    refill rate passed in by the caller, so rules can change without
+    rewriting buckets. A bucket that has refilled completely is
+    indistinguishable from a new one, so ``evict_full`` can drop it and
+    reuse the slot.
+    """
+
+    def __init__(self, max_buckets=1_000_000):
+        self.max_buckets = max_buckets
+        self._slots = {}
+        self._keys = []
+        self._free = []
+        self._tokens = array.array('d')
+        self._updated = array.array('d')
+        self._full_at = array.array('d')
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _level(self, slot, burst, rate, now):
+        return min(burst, self._tokens[slot] + (now - self._updated[slot]) * rate)
+
+    def available(self, key, burst, rate, now=None):
+        slot = self._slots.get(key)
+        if slot is None:
+            return burst
+        return self._level(slot, burst, rate, time.monotonic() if now is None else now)
+
+    def _store(self, key, tokens, burst, rate, now):
+        slot = self._slots.get(key)
+        if slot is None:
+            if len(self._slots) >= self.max_buckets:
+                # Full of busy buckets; leave this key unlimited rather than grow without bound
+                return False
+            if self._free:
+                slot = self._free.pop()
+                self._keys[slot] = key
+            else:
+                slot = len(self._keys)
+                self._keys.append(key)
+                self._tokens.append(0.0)
+                self._updated.append(0.0)
+                self._full_at.append(0.0)
+            self._slots[key] = slot
+        self._tokens[slot] = tokens
+        self._updated[slot] = now
+        self._full_at[slot] = now + (burst - tokens) / rate if rate > 0 else float('inf')
+        return True
+
+    def take(self, key, cost, burst, rate, now=None):
+        """Remove ``cost`` tokens if the bucket has them; returns whether it did."""
+        now = time.monotonic() if now is None else now
+        tokens = self.available(key, burst, rate, now)
+        if tokens < cost:
+            return False
+        self._store(key, tokens - cost, burst, rate, now)
+        return True
+
+    def refund(self, key, cost, burst, rate, now=None):
+        now = time.monotonic() if now is None else now
+        if key in self._slots:
+            self._store(key, min(burst, self.available(key, burst, rate, now) + cost), burst, rate, now)
+
+    def evict_full(self, now=None, start=0, count=None):
+        """Free the slots of buckets that have refilled; returns ``(evicted, next_start)``.
+
+        ``start``/``count`` bound a pass to part of the slot range so large
+        tables can be swept incrementally.
+        """
+        now = time.monotonic() if now is None else now
+        end = len(self._keys) if count is None else min(len(self._keys), start + count)
+        evicted = 0
+        for slot in range(start, end):
+            key = self._keys[slot]
+            if key is not None and self._full_at[slot] <= now:
+                del self._slots[key]
+                self._keys[slot] = None
+                self._free.append(slot)
+                evicted += 1
+        return evicted, (0 if end >= len(self._keys) else end)
+
+
+def _cost(count, limit):
+    # A bucket never holds more than its burst size, so a larger upload costs a full bucket
+    return min(count, limit[0])
+
+
+def _user_key(user_id, channel_id):
+    # One int instead of a tuple roughly halves the per-bucket overhead; snowflakes fit in 64 bits
+    return (user_id << 64) | channel_id
+
+
+class BurstLimiter:
+    """Short-term upload rate limits per (user, channel) and per channel.
+
+    Limits are ``(burst_size, refill_per_second)`` pairs, or None for no
+    limit. An upload of ``count`` attachments needs that many tokens from
+    both buckets, capped at each bucket's burst size: a message with more
+    attachments than the burst size is allowed when the bucket is full and
+    empties it. The check and the take happen without yielding, so
+    concurrent messages cannot both spend the last tokens.
+    """
+
+    def __init__(self, max_buckets=1_000_000, sweep_interval=60.0, sweep_chunk=50_000):
+        self.users = TokenBuckets(max_buckets)
+        self.channels = TokenBuckets(max_buckets)
+        self.sweep_interval = sweep_interval
+        self.sweep_chunk = sweep_chunk
+        self._sweep_task = None
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+            self._sweep_task = None
+
+    def try_acquire(self, user_id, channel_id, count, user_limit, channel_limit):
+        if user_limit is None and channel_limit is None:
+            return True
+        now = time.monotonic()
+        user_key = _user_key(user_id, channel_id)
+        if user_limit is not None and self.users.available(user_key, *user_limit, now) < _cost(count, user_limit):
+            return False
+        if channel_limit is not None and self.channels.available(channel_id, *channel_limit, now) < _cost(count, channel_limit):
+            return False
+        if user_limit is not None:
+            self.users.take(user_key, _cost(count, user_limit), *user_limit, now)
+        if channel_limit is not None:
+            self.channels.take(channel_id, _cost(count, channel_limit), *channel_limit, now)
+        return True
+
+    def release(self, user_id, channel_id, count, user_limit, channel_limit):
+        """Give back tokens for an upload that was rejected for another reason."""
+        if user_limit is not None:
+            self.users.refund(_user_key(user_id, channel_id), _cost(count, user_limit), *user_limit)
+        if channel_limit is not None:
+            self.channels.refund(channel_id, _cost(count, channel_limit), *channel_limit)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            for buckets in (self.users, self.channels):
+                start = 0
+                while True:
+                    _, start = buckets.evict_full(start=start, count=self.sweep_chunk)
+                    if not start:
+                        break
+                    # Let message handling run between chunks of a large table
+                    await asyncio.sleep(0)
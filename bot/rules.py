@@ -0,0 +1,188 @@
+import time
+
+
+class ChannelRules:
+    """Compiled upload rules for a single channel."""
+
+    __slots__ = ('guild_id', 'blocked', 'limits', 'reset_frequency', 'timezone', 'channel_burst', 'version', 'checked_at')
+
+    def __init__(self, guild_id, blocked, limits, reset_frequency, timezone, channel_burst, version):
+        self.guild_id = guild_id
+        self.blocked = blocked
+        # role_id -> (priority, max_uploads, reset_frequency, burst); lower priority wins
+        self.limits = limits
+        # Channel-wide window used when only the global default applies
+        self.reset_frequency = reset_frequency
+        self.timezone = timezone
+        # (burst_size, refill_per_second) shared by everyone in the channel, or None
+        self.channel_burst = channel_burst
+        self.version = version
+        # When the version was last compared with settings_versions
+        self.checked_at = time.monotonic()
+
+
+def burst_limit(burst_size, refill_per_minute):
+    """Token-bucket settings from a channel_settings row, or None when either is unset."""
+    if not burst_size or not refill_per_minute:
+        return None
+    return burst_size, refill_per_minute / 60.0
+
+
+SETTINGS_COLUMNS = """
+    role_name, max_uploads, reset_frequency, timezone,
+    burst_size, refill_per_minute, channel_burst_size, channel_refill_per_minute
+"""
+
+
+class RuleIndex:
+    """Per-channel rule index keyed by role ID.
+
+    Entries are compiled on first use from channel_settings and
+    blocked_channels, then kept until a change notification for that channel
+    (or a role change in its guild) drops them. Notifications can be lost, so
+    an entry older than ``recheck_after`` seconds has its version compared
+    with settings_versions on its next use, and the global default is
+    re-read as often. Nothing else is re-read per message.
+    """
+
+    def __init__(self, db_pool, recheck_after=300.0):
+        self.db_pool = db_pool
+        self.recheck_after = recheck_after
+        self._channels = {}
+        # Bumped on every invalidation so a compile that raced with a change is not stored
+        self._epochs = {}
+        self._default_max_uploads = None
+        self._global_version = None
+        self._global_checked_at = 0.0
+
+    async def _load_global(self):
+        async with self.db_pool.acquire('rules_global') as db:
+            async with db.execute("SELECT default_max_uploads FROM global_settings WHERE id = 1") as cursor:
+                global_settings = await cursor.fetchone()
+            async with db.execute("SELECT version FROM settings_versions WHERE scope_id = 0") as cursor:
+                version = await cursor.fetchone()
+        self._default_max_uploads = global_settings[0] if global_settings else None
+        self._global_version = version[0] if version else 0
+
+    async def _compile(self, channel_id, guild):
+        epoch = self._epochs.get(channel_id, 0)
+        async with self.db_pool.acquire('rules_compile') as db:
+            async with db.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)) as cursor:
+                blocked = await cursor.fetchone() is not None
+            async with db.execute(f"SELECT {SETTINGS_COLUMNS} FROM channel_settings WHERE channel_id = ? ORDER BY order_index",
+                                  (channel_id,)) as cursor:
+                rows = await cursor.fetchall()
+            async with db.execute("SELECT version FROM settings_versions WHERE scope_id = ?", (channel_id,)) as cursor:
+                version = await cursor.fetchone()
+
+        rules = self._build(guild, blocked, rows, version[0] if version else 0)
+        if self._epochs.get(channel_id, 0) == epoch:
+            self._channels[channel_id] = rules
+        return rules
+
+    def _build(self, guild, blocked, rows, version):
+        # Rules name roles; map them onto this guild's role IDs once, here, instead of per message
+        role_ids_by_name = {}
+        for role in getattr(guild, 'roles', ()):
+            role_ids_by_name.setdefault(role.name, []).append(role.id)
+
+        limits = {}
+        channel_frequency = 'daily'
+        channel_timezone = None
+        channel_burst = None
+        for priority, row in enumerate(rows):
+            role_name, max_uploads, reset_frequency, timezone = row[:4]
+            if priority == 0:
+                channel_frequency = reset_frequency or 'daily'
+            channel_timezone = channel_timezone or timezone
+            channel_burst = channel_burst or burst_limit(row[6], row[7])
+            for role_id in role_ids_by_name.get(role_name, ()):
+                limits.setdefault(role_id, (priority, max_uploads, reset_frequency or 'daily', burst_limit(row[4], row[5])))
+
+        return ChannelRules(getattr(guild, 'id', None), blocked, limits, channel_frequency,
+                            channel_timezone, channel_burst, version)
+
+    async def warm(self, channels):
+        """Compile rules for many ``(channel_id, guild)`` pairs from three queries in total.
+
+        Channels that already have rules, or that are invalidated while the
+        queries run, are left for ``get`` to compile.
+        """
+        if self._global_version is None:
+            await self._load_global()
+        epochs = {channel_id: self._epochs.get(channel_id, 0) for channel_id, _ in channels}
+        async with self.db_pool.acquire('rules_warm') as db:
+            async with db.execute("SELECT channel_id FROM blocked_channels") as cursor:
+                blocked = {row[0] for row in await cursor.fetchall()}
+            async with db.execute(f"SELECT channel_id, {SETTINGS_COLUMNS} FROM channel_settings ORDER BY channel_id, order_index") as cursor:
+                rows_by_channel = {}
+                for row in await cursor.fetchall():
+                    rows_by_channel.setdefault(row[0], []).append(row[1:])
+            async with db.execute("SELECT scope_id, version FROM settings_versions") as cursor:
+                versions = dict(await cursor.fetchall())
+
+        warmed = 0
+        for channel_id, guild in channels:
+            if channel_id in self._channels or self._epochs.get(channel_id, 0) != epochs[channel_id]:
+                continue
+            self._channels[channel_id] = self._build(guild, channel_id in blocked, rows_by_channel.get(channel_id, ()),
+                                                     versions.get(channel_id, 0))
+            warmed += 1
+        return warmed
+
+    async def _recheck(self, channel_id, rules, guild):
+        async with self.db_pool.acquire('rules_recheck') as db:
+            async with db.execute("SELECT version FROM settings_versions WHERE scope_id = ?", (channel_id,)) as cursor:
+                version = await cursor.fetchone()
+        version = version[0] if version else 0
+        if version == rules.version:
+            return rules
+        self.invalidate(channel_id, version)
+        return self._channels.get(channel_id) or await self._compile(channel_id, guild)
+
+    async def get(self, channel_id, guild):
+        now = time.monotonic()
+        if self._global_version is None or now - self._global_checked_at > self.recheck_after:
+            self._global_checked_at = now
+            await self._load_global()
+        rules = self._channels.get(channel_id)
+        if rules is None:
+            rules = await self._compile(channel_id, guild)
+        elif now - rules.checked_at > self.recheck_after:
+            # Marked before the query so concurrent messages do not all recheck
+            rules.checked_at = now
+            rules = await self._recheck(channel_id, rules, guild)
+        return rules
+
+    def resolve(self, rules, role_ids):
+        """Return ``(max_uploads, reset_frequency, burst)`` for a member's role IDs.
+
+        ``max_uploads`` is None when neither a role rule nor a global default
+        applies; ``burst`` is the per-user token-bucket limit of the winning
+        rule, or None.
+        """
+        best = None
+        limits = rules.limits
+        for role_id in role_ids:
+            limit = limits.get(role_id)
+            if limit is not None and (best is None or limit[0] < best[0]):
+                best = limit
+        if best is not None:
+            return best[1], best[2], best[3]
+        return self._default_max_uploads, rules.reset_frequency, None
+
+    def invalidate(self, channel_id, version=None):
+        rules = self._channels.get(channel_id)
+        if version is not None and rules is not None and rules.version >= version:
+            return
+        self._epochs[channel_id] = self._epochs.get(channel_id, 0) + 1
+        self._channels.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id):
+        for channel_id in [cid for cid, rules in self._channels.items() if rules.guild_id == guild_id]:
+            self.invalidate(channel_id)
+
+    def invalidate_global(self, version=None):
+        if version is not None and self._global_version is not None and self._global_version >= version:
+            return
+        self._global_version = None
@@ -0,0 +1,46 @@
+import os
+
+
+def process_count():
+    """Number of bot processes sharing the gateway (SHARD_PROCESSES, default 1)."""
+    return int(os.getenv('SHARD_PROCESSES', 1))
+
+
+def process_index():
+    """This process's position among the bot processes (SHARD_PROCESS_INDEX, default 0)."""
+    return int(os.getenv('SHARD_PROCESS_INDEX', 0))
+
+
+def is_primary():
+    # Work that must happen once per deployment (scheduled jobs) runs in the first process only
+    return process_index() == 0
+
+
+def shard_settings():
+    """Return ``(shard_count, shard_ids)`` for this process.
+
+    SHARD_IDS names the shards explicitly (``0,1,2``). Otherwise the
+    SHARD_COUNT shards are dealt round-robin across SHARD_PROCESSES
+    processes. ``(None, None)`` lets discord.py pick the shard count and run
+    every shard here.
+    """
+    shard_count = os.getenv('SHARD_COUNT')
+    shard_ids = os.getenv('SHARD_IDS')
+    processes = process_count()
+    index = process_index()
+
+    if shard_count is None:
+        if shard_ids or processes > 1:
+            raise ValueError("SHARD_COUNT must be set when SHARD_IDS or SHARD_PROCESSES is used")
+        return None, None
+    shard_count = int(shard_count)
+
+    if shard_ids:
+        ids = sorted({int(shard_id) for shard_id in shard_ids.split(',')})
+    else:
+        if not 0 <= index < processes:
+            raise ValueError(f"SHARD_PROCESS_INDEX must be between 0 and {processes - 1}")
+        ids = list(range(index, shard_count, processes))
+    if not ids or ids[0] < 0 or ids[-1] >= shard_count:
+        raise ValueError(f"Shard IDs {ids} do not fit SHARD_COUNT={shard_count}")
+    return shard_count, ids
@@ -0,0 +1,258 @@
+import csv
+import io
+import os
+
+from shared import periods
+
+# Jobs writing more rows than this run in a background thread and are polled for their status
+BULK_BACKGROUND_ROWS = int(os.getenv('BULK_BACKGROUND_ROWS', 500))
+
+RESET_FREQUENCIES = ('daily', 'weekly')
+
+# One row per rule; channel-wide columns repeat on every row of a channel, and a
+# channel without rules has a single row with an empty role_name
+CSV_COLUMNS = ('channel_id', 'channel_name', 'blocked', 'reset_frequency', 'timezone',
+               'channel_burst_size', 'channel_refill_per_minute',
+               'role_name', 'max_uploads', 'burst_size', 'refill_per_minute')
+
+INSERT_SETTING = """
+    INSERT INTO channel_settings (channel_id, role_name, max_uploads, order_index, burst_size, refill_per_minute,
+                                  reset_frequency, timezone, channel_burst_size, channel_refill_per_minute)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _optional(value, convert):
+    if value is None or value == '':
+        return None
+    return convert(value)
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _burst_pair(burst_size, refill_per_minute, what):
+    burst_size = _optional(burst_size, int)
+    refill_per_minute = _optional(refill_per_minute, float)
+    if burst_size is None and refill_per_minute is None:
+        return None, None
+    if not burst_size or burst_size < 1 or not refill_per_minute or refill_per_minute <= 0:
+        raise ValueError(f'{what} burst size and refill rate must both be positive')
+    return burst_size, refill_per_minute
+
+
+def parse_template(data):
+    """Validate a channel template: its rules in priority order plus channel-wide settings."""
+    if not isinstance(data, dict):
+        raise ValueError('A template must be an object')
+    reset_frequency = data.get('reset_frequency') or None
+    if reset_frequency is not None and reset_frequency not in RESET_FREQUENCIES:
+        raise ValueError(f'Unknown reset frequency: {reset_frequency}')
+    timezone = data.get('timezone') or None
+    if timezone is not None and not periods.is_valid_timezone(timezone):
+        raise ValueError(f'Unknown timezone: {timezone}')
+    channel_burst_size, channel_refill_per_minute = _burst_pair(
+        data.get('channel_burst_size'), data.get('channel_refill_per_minute'), 'Channel')
+
+    rules = []
+    for rule in data.get('rules') or ():
+        if not isinstance(rule, dict):
+            raise ValueError('Every rule must be an object')
+        role_name = rule.get('role_name')
+        if not role_name:
+            raise ValueError('Every rule needs a role_name')
+        max_uploads = _optional(rule.get('max_uploads'), int)
+        if max_uploads is None or max_uploads < 0:
+            raise ValueError(f'Rule for {role_name} needs a max_uploads of 0 or more')
+        burst_size, refill_per_minute = _burst_pair(rule.get('burst_size'), rule.get('refill_per_minute'), role_name)
+        rules.append({'role_name': role_name, 'max_uploads': max_uploads,
+                      'burst_size': burst_size, 'refill_per_minute': refill_per_minute})
+
+    return {'rules': rules, 'reset_frequency': reset_frequency, 'timezone': timezone,
+            'channel_burst_size': channel_burst_size, 'channel_refill_per_minute': channel_refill_per_minute}
+
+
+def parse_config(data):
+    """Validate an imported configuration (the shape ``export_config`` produces)."""
+    if not isinstance(data, dict) or not isinstance(data.get('channels', []), list):
+        raise ValueError('A configuration must be an object with a list of channels')
+    config = {'channels': []}
+    if data.get('default_max_uploads') is not None:
+        config['default_max_uploads'] = int(data['default_max_uploads'])
+    seen = set()
+    for channel in data.get('channels', []):
+        if not isinstance(channel, dict):
+            raise ValueError('Every channel must be an object')
+        channel_id = _optional(channel.get('channel_id'), int)
+        if channel_id is None:
+            raise ValueError('Every channel needs a channel_id')
+        if channel_id in seen:
+            raise ValueError(f'Channel {channel_id} appears more than once')
+        seen.add(channel_id)
+        try:
+            template = parse_template(channel)
+        except ValueError as e:
+            raise ValueError(f'Channel {channel_id}: {e}')
+        config['channels'].append(dict(template, channel_id=channel_id, blocked=_flag(channel.get('blocked'))))
+    return config
+
+
+def config_from_csv(text):
+    """Turn CSV_COLUMNS rows into the dict ``parse_config`` accepts."""
+    channels = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        if not row.get('channel_id'):
+            continue
+        channel = channels.get(row['channel_id'])
+        if channel is None:
+            channel = channels[row['channel_id']] = {
+                key: row.get(key) for key in CSV_COLUMNS[:7]}
+            channel['rules'] = []
+        if row.get('role_name'):
+            channel['rules'].append({key: row.get(key) for key in CSV_COLUMNS[7:]})
+    return {'channels': list(channels.values())}
+
+
+SETTINGS_COLUMNS = """
+    s.channel_id, s.role_name, s.max_uploads, s.burst_size, s.refill_per_minute,
+    s.reset_frequency, s.timezone, s.channel_burst_size, s.channel_refill_per_minute
+"""
+
+
+def _templates(rows):
+    """Group channel_settings rows (in order_index order) into templates by channel."""
+    templates = {}
+    for row in rows:
+        template = templates.get(row['channel_id'])
+        if template is None:
+            # The bot takes the reset frequency from the first rule and the rest from the first row that has them
+            template = templates[row['channel_id']] = {
+                'reset_frequency': row['reset_frequency'], 'timezone': None,
+                'channel_burst_size': None, 'channel_refill_per_minute': None, 'rules': []}
+        template['timezone'] = template['timezone'] or row['timezone']
+        if template['channel_burst_size'] is None:
+            template['channel_burst_size'] = row['channel_burst_size']
+            template['channel_refill_per_minute'] = row['channel_refill_per_minute']
+        if row['role_name']:
+            template['rules'].append({key: row[key] for key in ('role_name', 'max_uploads', 'burst_size', 'refill_per_minute')})
+    return templates
+
+
+def channel_template(conn, channel_id):
+    """The template matching a channel's current settings, or None when it has none."""
+    rows = conn.execute(f"SELECT {SETTINGS_COLUMNS} FROM channel_settings s WHERE s.channel_id = ? ORDER BY s.order_index",
+                        (channel_id,)).fetchall()
+    return _templates(rows).get(channel_id)
+
+
+def export_config(conn):
+    """Read every configured or blocked channel, plus the global default."""
+    default = conn.execute("SELECT default_max_uploads FROM global_settings WHERE id = 1").fetchone()
+    rows = conn.execute(f"SELECT {SETTINGS_COLUMNS} FROM channel_settings s ORDER BY s.channel_id, s.order_index").fetchall()
+    blocked = {row[0] for row in conn.execute("SELECT channel_id FROM blocked_channels")}
+    names = dict(conn.execute("SELECT channel_id, channel_name FROM channel_names").fetchall())
+
+    templates = _templates(rows)
+    for channel_id in blocked - set(templates):
+        templates[channel_id] = {'reset_frequency': None, 'timezone': None, 'channel_burst_size': None,
+                                 'channel_refill_per_minute': None, 'rules': []}
+    channels = [dict(templates[channel_id], channel_id=channel_id, channel_name=names.get(channel_id),
+                     blocked=channel_id in blocked)
+                for channel_id in sorted(templates)]
+    return {'default_max_uploads': default[0] if default else None, 'channels': channels}
+
+
+def export_csv(config):
+    """Yield the channels of an exported configuration as CSV text, one line at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    for channel in config['channels']:
+        head = [channel[key] for key in CSV_COLUMNS[:7]]
+        head[2] = int(head[2])
+        for rule in channel['rules'] or [dict.fromkeys(CSV_COLUMNS[7:])]:
+            writer.writerow(head + [rule[key] for key in CSV_COLUMNS[7:]])
+            yield flush()
+
+
+def settings_rows(channel_id, template):
+    """channel_settings rows that give ``channel_id`` exactly the settings in ``template``."""
+    channel_wide = (template['reset_frequency'], template['timezone'],
+                    template['channel_burst_size'], template['channel_refill_per_minute'])
+    rules = template['rules']
+    if not rules:
+        # Channel-wide settings without rules still need a row to live on
+        return [(channel_id, None, None, 0, None, None) + channel_wide] if any(channel_wide) else []
+    return [(channel_id, rule['role_name'], rule['max_uploads'], order_index,
+             rule['burst_size'], rule['refill_per_minute']) + channel_wide
+            for order_index, rule in enumerate(rules)]
+
+
+class BulkJob:
+    """A list of ``(statement, rows)`` steps written with executemany in one transaction."""
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, statement, rows):
+        rows = list(rows)
+        if rows:
+            self.steps.append((statement, rows))
+
+    @property
+    def total(self):
+        return sum(len(rows) for _, rows in self.steps)
+
+    def run(self, conn):
+        """Execute every step inside one transaction.
+
+        Nothing is committed here; the caller commits once all steps are done,
+        so a failure part way leaves the database as it was.
+        """
+        # Take the write lock up front instead of upgrading half way through
+        conn.execute("BEGIN IMMEDIATE")
+        for statement, rows in self.steps:
+            conn.executemany(statement, rows)
+
+
+def replace_channels_job(templates):
+    """Job that replaces the rules of each channel in ``templates`` (channel_id -> template)."""
+    job = BulkJob()
+    job.add("DELETE FROM channel_settings WHERE channel_id = ?", [(channel_id,) for channel_id in templates])
+    job.add(INSERT_SETTING, [row for channel_id, template in templates.items()
+                             for row in settings_rows(channel_id, template)])
+    return job
+
+
+def import_job(config):
+    """Job that applies a parsed configuration; channels missing from it are left alone."""
+    channels = config['channels']
+    job = replace_channels_job({channel['channel_id']: channel for channel in channels})
+    job.add("DELETE FROM blocked_channels WHERE channel_id = ?", [(channel['channel_id'],) for channel in channels])
+    job.add("INSERT INTO blocked_channels (channel_id) VALUES (?)",
+            [(channel['channel_id'],) for channel in channels if channel['blocked']])
+    if 'default_max_uploads' in config:
+        job.add("INSERT OR REPLACE INTO global_settings (id, default_max_uploads) VALUES (1, ?)",
+                [(config['default_max_uploads'],)])
+    return job
+
+
+def reset_channels_job(channel_ids):
+    job = BulkJob()
+    job.add("""
+        UPDATE user_channel_uploads
+        SET uploads = 0, last_reset = CURRENT_TIMESTAMP
+        WHERE channel_id = ?
+    """, [(channel_id,) for channel_id in channel_ids])
+    return job
@@ -1,149 +1,545 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-import sqlite3
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, abort, g, has_request_context
+import functools
+import hashlib
+import json
+import datetime
+import logging
 import os
+import sqlite3
+import threading
+import time
 from dotenv import load_dotenv
+from dashboard import bulk
+from shared.db import ConnectionPool
+from shared import notify, periods, summary
+from shared.log import setup_logging
+from shared.metrics import CONTENT_TYPE, REGISTRY, Histogram
 
 # Load environment variables
 load_dotenv()
+setup_logging()
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
+# Long-lived connections reused across requests (see shared/db.py). Page views use
+# read-only connections; only the routes that change settings can write.
+db_pool = ConnectionPool(size=int(os.getenv('DATABASE_POOL_SIZE', 4)))
+read_pool = ConnectionPool(size=int(os.getenv('DATABASE_READ_POOL_SIZE', 4)), readonly=True)
+
 def get_db_connection():
-    conn = sqlite3.connect('file_uploads.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    if not has_request_context():
+        return db_pool.connection('other')
+    # Database time is labelled with the route that used the connection
+    pool = read_pool if request.method in ('GET', 'HEAD') else db_pool
+    return pool.connection(request.endpoint or 'other')
+
+# Each gunicorn worker keeps its own registry, so /metrics reports the worker that answered
+REQUEST_SECONDS = Histogram(
+    'dashboard_request_seconds', 'Dashboard request duration, by endpoint and status', ['endpoint', 'status'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.labels(request.endpoint or 'unknown', response.status_code).observe(time.perf_counter() - started)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), headers={'Content-Type': CONTENT_TYPE})
+
+def conditional_page(view):
+    """Answer a GET view with an ETag of its body, and 304 when the client already has it.
+
+    The page is rendered on every request: the bot commits counters all the
+    time, so no database-wide version stays still long enough for a cached
+    render to be reused. Hashing the body means a client polling a page whose
+    content did not change still gets 304, whichever worker answers.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+        # Browsers must revalidate, which usually ends in a 304
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
 
 @app.route('/')
 def index():
     return redirect(url_for('channels'))
 
 @app.route('/channels')
+@conditional_page
 def channels():
-    conn = get_db_connection()
-    channels = conn.execute("""
-        SELECT cn.channel_id, cn.channel_name,
-               COUNT(DISTINCT cs.role_name) as role_count,
-               CASE WHEN bc.channel_id IS NOT NULL THEN 1 ELSE 0 END as is_blocked
-        FROM channel_names cn
-        LEFT JOIN channel_settings cs ON cn.channel_id = cs.channel_id
-        LEFT JOIN blocked_channels bc ON cn.channel_id = bc.channel_id
-        GROUP BY cn.channel_id
-        ORDER BY cn.channel_name
-    """).fetchall()
-    conn.close()
+    channels = load_channel_summaries()
     return render_template('channels.html', channels=channels, active_page='channels')
 
+def load_channel_summaries():
+    # channel_summary is maintained by triggers (see shared/summary.py), so this is a plain join
+    with get_db_connection() as conn:
+        rows = conn.execute("""
+            SELECT cn.channel_id, cn.channel_name,
+                   COALESCE(s.role_count, 0) as role_count,
+                   COALESCE(s.is_blocked, 0) as is_blocked,
+                   COALESCE(s.total_uploads, 0) as total_uploads,
+                   COALESCE(s.user_count, 0) as user_count,
+                   COALESCE(s.top_uploaders, '[]') as top_uploaders
+            FROM channel_names cn
+            LEFT JOIN channel_summary s ON cn.channel_id = s.channel_id
+            ORDER BY cn.channel_name
+        """).fetchall()
+    return [dict(row, top_uploaders=json.loads(row['top_uploaders'])) for row in rows]
+
 @app.route('/channel/<int:channel_id>')
+@conditional_page
 def channel_settings(channel_id):
-    conn = get_db_connection()
-    channel = conn.execute("SELECT cn.*, COALESCE(cs.reset_frequency, 'daily') as reset_frequency FROM channel_names cn LEFT JOIN channel_settings cs ON cn.channel_id = cs.channel_id WHERE cn.channel_id = ? LIMIT 1", (channel_id,)).fetchone()
-    settings = conn.execute("SELECT * FROM channel_settings WHERE channel_id = ? ORDER BY order_index", (channel_id,)).fetchall()
-    is_blocked = conn.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)).fetchone() is not None
-    conn.close()
+    with get_db_connection() as conn:
+        channel = conn.execute("SELECT cn.*, COALESCE(cs.reset_frequency, 'daily') as reset_frequency, COALESCE(cs.timezone, ?) as timezone, cs.channel_burst_size, cs.channel_refill_per_minute FROM channel_names cn LEFT JOIN channel_settings cs ON cn.channel_id = cs.channel_id WHERE cn.channel_id = ? LIMIT 1", (periods.DEFAULT_TIMEZONE, channel_id)).fetchone()
+        settings = conn.execute("SELECT * FROM channel_settings WHERE channel_id = ? ORDER BY order_index", (channel_id,)).fetchall()
+        is_blocked = conn.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)).fetchone() is not None
     return render_template('channel_settings.html', channel=channel, settings=settings, is_blocked=is_blocked, active_page='channels')
 
+def parse_burst_limit(form, prefix=''):
+    """Read an optional (burst size, refill per minute) pair; both blank means no burst limit."""
+    burst_size = form.get(f'{prefix}burst_size', type=int)
+    refill_per_minute = form.get(f'{prefix}refill_per_minute', type=float)
+    if burst_size is None and refill_per_minute is None:
+        return None, None
+    if not burst_size or burst_size < 1 or not refill_per_minute or refill_per_minute <= 0:
+        raise ValueError('Burst size and refill rate must both be positive')
+    return burst_size, refill_per_minute
+
 @app.route('/update_channel_settings/<int:channel_id>', methods=['POST'])
 def update_channel_settings(channel_id):
     role_name = request.form['role_name']
     max_uploads = request.form['max_uploads']
-    conn = get_db_connection()
-    max_order = conn.execute("SELECT MAX(order_index) FROM channel_settings WHERE channel_id = ?", (channel_id,)).fetchone()[0]
-    new_order = (max_order or 0) + 1
-    conn.execute("INSERT INTO channel_settings (channel_id, role_name, max_uploads, order_index) VALUES (?, ?, ?, ?)",
-                 (channel_id, role_name, max_uploads, new_order))
-    conn.commit()
-    conn.close()
+    try:
+        burst_size, refill_per_minute = parse_burst_limit(request.form)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('channel_settings', channel_id=channel_id))
+    with get_db_connection() as conn:
+        max_order = conn.execute("SELECT MAX(order_index) FROM channel_settings WHERE channel_id = ?", (channel_id,)).fetchone()[0]
+        new_order = (max_order or 0) + 1
+        # New rules carry the channel-wide settings (reset window, timezone, burst limit) of the rows already there
+        conn.execute("""
+            INSERT INTO channel_settings (channel_id, role_name, max_uploads, order_index, burst_size, refill_per_minute,
+                                          reset_frequency, timezone, channel_burst_size, channel_refill_per_minute)
+            SELECT ?, ?, ?, ?, ?, ?, COALESCE(reset_frequency, 'daily'), timezone, channel_burst_size, channel_refill_per_minute
+            FROM (SELECT NULL) LEFT JOIN (SELECT reset_frequency, timezone, channel_burst_size, channel_refill_per_minute
+                                          FROM channel_settings WHERE channel_id = ? ORDER BY order_index LIMIT 1)
+        """, (channel_id, role_name, max_uploads, new_order, burst_size, refill_per_minute, channel_id))
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
     flash('Role upload limit added successfully!', 'success')
     return redirect(url_for('channel_settings', channel_id=channel_id))
 
 @app.route('/update_channel_reset_frequency/<int:channel_id>', methods=['POST'])
 def update_channel_reset_frequency(channel_id):
     reset_frequency = request.form['reset_frequency']
-    conn = get_db_connection()
-    conn.execute("UPDATE channel_settings SET reset_frequency = ? WHERE channel_id = ?", (reset_frequency, channel_id))
-    if conn.execute("SELECT changes()").fetchone()[0] == 0:
-        conn.execute("INSERT INTO channel_settings (channel_id, reset_frequency) VALUES (?, ?)", (channel_id, reset_frequency))
-    conn.commit()
-    conn.close()
+    timezone = request.form.get('timezone') or periods.DEFAULT_TIMEZONE
+    if not periods.is_valid_timezone(timezone):
+        flash(f'Unknown timezone: {timezone}', 'error')
+        return redirect(url_for('channel_settings', channel_id=channel_id))
+    with get_db_connection() as conn:
+        conn.execute("UPDATE channel_settings SET reset_frequency = ?, timezone = ? WHERE channel_id = ?", (reset_frequency, timezone, channel_id))
+        if conn.execute("SELECT changes()").fetchone()[0] == 0:
+            conn.execute("INSERT INTO channel_settings (channel_id, reset_frequency, timezone) VALUES (?, ?, ?)", (channel_id, reset_frequency, timezone))
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
     flash('Channel reset frequency updated successfully!', 'success')
     return redirect(url_for('channel_settings', channel_id=channel_id))
 
+@app.route('/update_channel_burst_limit/<int:channel_id>', methods=['POST'])
+def update_channel_burst_limit(channel_id):
+    try:
+        burst_size, refill_per_minute = parse_burst_limit(request.form, 'channel_')
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('channel_settings', channel_id=channel_id))
+    with get_db_connection() as conn:
+        conn.execute("UPDATE channel_settings SET channel_burst_size = ?, channel_refill_per_minute = ? WHERE channel_id = ?", (burst_size, refill_per_minute, channel_id))
+        if conn.execute("SELECT changes()").fetchone()[0] == 0:
+            conn.execute("INSERT INTO channel_settings (channel_id, channel_burst_size, channel_refill_per_minute) VALUES (?, ?, ?)", (channel_id, burst_size, refill_per_minute))
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
+    flash('Channel burst limit updated successfully!', 'success')
+    return redirect(url_for('channel_settings', channel_id=channel_id))
+
 @app.route('/reorder_channel_settings/<int:channel_id>', methods=['POST'])
 def reorder_channel_settings(channel_id):
     new_order = request.json['new_order']
-    conn = get_db_connection()
-    for index, setting_id in enumerate(new_order):
-        conn.execute("UPDATE channel_settings SET order_index = ? WHERE id = ? AND channel_id = ?", (index, setting_id, channel_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.executemany("UPDATE channel_settings SET order_index = ? WHERE id = ? AND channel_id = ?",
+                         [(index, setting_id, channel_id) for index, setting_id in enumerate(new_order)])
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
     return jsonify({'status': 'success'})
 
 @app.route('/delete_channel_settings/<int:channel_id>/<int:setting_id>', methods=['POST'])
 def delete_channel_settings(channel_id, setting_id):
-    conn = get_db_connection()
-    conn.execute("DELETE FROM channel_settings WHERE id = ? AND channel_id = ?", (setting_id, channel_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM channel_settings WHERE id = ? AND channel_id = ?", (setting_id, channel_id))
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
 
     flash('Channel setting deleted successfully!', 'success')
     return redirect(url_for('channel_settings', channel_id=channel_id))
 
 @app.route('/toggle_channel_block/<int:channel_id>', methods=['POST'])
 def toggle_channel_block(channel_id):
-    conn = get_db_connection()
-    is_blocked = conn.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)).fetchone() is not None
-
-    if is_blocked:
-        conn.execute("DELETE FROM blocked_channels WHERE channel_id = ?", (channel_id,))
-        flash('Channel unblocked successfully!', 'success')
-    else:
-        conn.execute("INSERT INTO blocked_channels (channel_id) VALUES (?)", (channel_id,))
-        flash('Channel blocked successfully!', 'success')
-
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        is_blocked = conn.execute("SELECT 1 FROM blocked_channels WHERE channel_id = ?", (channel_id,)).fetchone() is not None
+
+        if is_blocked:
+            conn.execute("DELETE FROM blocked_channels WHERE channel_id = ?", (channel_id,))
+            flash('Channel unblocked successfully!', 'success')
+        else:
+            conn.execute("INSERT INTO blocked_channels (channel_id) VALUES (?)", (channel_id,))
+            flash('Channel blocked successfully!', 'success')
+
+        version = notify.bump_settings_version(conn, channel_id)
+        conn.commit()
+    notify.publish('channel', channel_id=channel_id, version=version)
     return redirect(url_for('channel_settings', channel_id=channel_id))
 
 @app.route('/update_global_settings', methods=['POST'])
 def update_global_settings():
     default_max_uploads = request.form['default_max_uploads']
 
-    conn = get_db_connection()
-    conn.execute("INSERT OR REPLACE INTO global_settings (id, default_max_uploads) VALUES (1, ?)",
-                 (default_max_uploads,))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute("INSERT OR REPLACE INTO global_settings (id, default_max_uploads) VALUES (1, ?)",
+                     (default_max_uploads,))
+        version = notify.bump_settings_version(conn, notify.GLOBAL_SCOPE)
+        conn.commit()
+    notify.publish('global', version=version)
 
     flash('Global settings updated successfully!', 'success')
     return redirect(url_for('channels'))
 
-@app.route('/users')
-def users():
-    conn = get_db_connection()
-    users = conn.execute("""
-        SELECT u.user_id, u.username, u.channel_id, u.uploads, u.last_reset,
+USERS_PAGE_SIZE = 100
+USERS_MAX_PAGE_SIZE = 500
+
+def parse_users_query(args):
+    """Read keyset cursor, page size and filters for the users views from query args."""
+    after = None
+    if args.get('after'):
+        user_id, _, channel_id = args['after'].partition(':')
+        try:
+            after = (int(user_id), int(channel_id))
+        except ValueError:
+            abort(400, "after must look like <user_id>:<channel_id>")
+    limit = min(args.get('limit', USERS_PAGE_SIZE, type=int), USERS_MAX_PAGE_SIZE)
+    return {
+        'after': after,
+        'limit': max(limit, 1),
+        'channel_id': args.get('channel_id', type=int),
+        'username_prefix': args.get('username') or None,
+        'min_uploads': args.get('min_uploads', type=int),
+    }
+
+def query_users(conn, after=None, limit=USERS_PAGE_SIZE, channel_id=None, username_prefix=None, min_uploads=None):
+    # Keyset pagination on the (user_id, channel_id) primary key keeps each page's cost flat
+    conditions = []
+    params = []
+    if after is not None:
+        conditions.append("(u.user_id, u.channel_id) > (?, ?)")
+        params.extend(after)
+    if channel_id is not None:
+        conditions.append("u.channel_id = ?")
+        params.append(channel_id)
+    if username_prefix:
+        # A range instead of LIKE so idx_user_channel_uploads_username can be used
+        conditions.append("u.username >= ? AND u.username < ?")
+        params.extend((username_prefix, username_prefix + '\U0010ffff'))
+    if min_uploads is not None:
+        conditions.append("u.uploads >= ?")
+        params.append(min_uploads)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    params.append(limit)
+    return conn.execute(f"""
+        SELECT u.user_id, u.username, u.channel_id, u.uploads, u.last_reset, u.period_id,
                COALESCE(cn.channel_name, 'Unknown Channel') as channel_name
         FROM user_channel_uploads u
         LEFT JOIN channel_names cn ON u.channel_id = cn.channel_id
+        {where}
         ORDER BY u.user_id, u.channel_id
-    """).fetchall()
-    conn.close()
-    return render_template('users.html', users=users, active_page='users')
+        LIMIT ?
+    """, params)
+
+@app.route('/users')
+@conditional_page
+def users():
+    query = parse_users_query(request.args)
+    with get_db_connection() as conn:
+        users = query_users(conn, **query).fetchall()
+        user_ids = sorted({user['user_id'] for user in users})
+        # Totals for users on this page only; rows of one user may span pages
+        user_totals = dict(conn.execute(f"""
+            SELECT user_id, SUM(uploads) FROM user_channel_uploads
+            WHERE user_id IN ({','.join('?' * len(user_ids))})
+            GROUP BY user_id
+        """, user_ids).fetchall()) if user_ids else {}
+        channels = conn.execute("SELECT channel_id, channel_name FROM channel_names ORDER BY channel_name").fetchall()
+
+    next_after = None
+    if len(users) == query['limit']:
+        next_after = f"{users[-1]['user_id']}:{users[-1]['channel_id']}"
+    filters = {key: request.args[key] for key in ('channel_id', 'username', 'min_uploads', 'limit') if request.args.get(key)}
+    return render_template('users.html', users=users, user_totals=user_totals, channels=channels,
+                           filters=filters, next_after=next_after, active_page='users')
+
+@app.route('/api/users')
+def api_users():
+    query = parse_users_query(request.args)
+
+    def generate():
+        # Rows are encoded as they are read so memory stays flat for large pages
+        last = None
+        yield '{"users": ['
+        with get_db_connection() as conn:
+            for index, user in enumerate(query_users(conn, **query)):
+                last = user
+                yield (',' if index else '') + json.dumps(dict(user))
+        count = index + 1 if last is not None else 0
+        next_after = f"{last['user_id']}:{last['channel_id']}" if last is not None and count == query['limit'] else None
+        yield '], "next_after": ' + json.dumps(next_after) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+USAGE_GRANULARITIES = {
+    'hourly': ('upload_rollups_hourly', datetime.timedelta(hours=48), '%Y-%m-%dT%H:00'),
+    'daily': ('upload_rollups_daily', datetime.timedelta(days=60), '%Y-%m-%d'),
+}
+
+@app.route('/usage')
+@conditional_page
+def usage():
+    with get_db_connection() as conn:
+        channels = conn.execute("SELECT channel_id, channel_name FROM channel_names ORDER BY channel_name").fetchall()
+    return render_template('usage.html', channels=channels, active_page='usage')
+
+@app.route('/api/usage')
+def api_usage():
+    granularity = request.args.get('granularity', 'daily')
+    if granularity not in USAGE_GRANULARITIES:
+        abort(400, "granularity must be 'hourly' or 'daily'")
+    table, default_span, bucket_format = USAGE_GRANULARITIES[granularity]
+    channel_id = request.args.get('channel_id', type=int)
+    since = request.args.get('since') or (datetime.datetime.now(datetime.timezone.utc) - default_span).strftime(bucket_format)
+
+    # Reads the rollups only; the raw upload_events log is never scanned here
+    conditions = ["bucket >= ?"]
+    params = [since]
+    if channel_id is not None:
+        conditions.append("channel_id = ?")
+        params.append(channel_id)
+    with get_db_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT bucket, decision, SUM(events) as events, SUM(attachments) as attachments, SUM(bytes) as bytes
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+            GROUP BY bucket, decision
+            ORDER BY bucket
+        """, params).fetchall()
+
+    buckets = sorted({row['bucket'] for row in rows})
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    series = {}
+    for row in rows:
+        decision = series.setdefault(row['decision'], {
+            'events': [0] * len(buckets), 'attachments': [0] * len(buckets), 'bytes': [0] * len(buckets)})
+        for field in ('events', 'attachments', 'bytes'):
+            decision[field][index[row['bucket']]] = row[field]
+    return jsonify({'granularity': granularity, 'since': since, 'buckets': buckets, 'series': series})
 
 @app.route('/reset_user/<int:user_id>/<int:channel_id>', methods=['POST'])
 def reset_user(user_id, channel_id):
-    conn = get_db_connection()
-    conn.execute("""
-        UPDATE user_channel_uploads
-        SET uploads = 0, last_reset = CURRENT_TIMESTAMP
-        WHERE user_id = ? AND channel_id = ?
-    """, (user_id, channel_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute("""
+            UPDATE user_channel_uploads
+            SET uploads = 0, last_reset = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND channel_id = ?
+        """, (user_id, channel_id))
+        summary.refresh_top_uploaders(conn, [channel_id])
+        conn.commit()
+    notify.publish('counter', user_id=user_id, channel_id=channel_id)
 
     flash(f'User {user_id} has been reset for channel {channel_id}.', 'success')
     return redirect(url_for('users'))
 
+def request_object():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object")
+    return data
+
+def parse_channel_ids(values):
+    try:
+        channel_ids = sorted({int(value) for value in values})
+    except (TypeError, ValueError):
+        abort(400, "channel_ids must be a list of channel IDs")
+    if not channel_ids:
+        abort(400, "channel_ids must not be empty")
+    return channel_ids
+
+def apply_bulk_job(conn, job, changed_channels, counter_channels, global_changed):
+    """Run ``job`` and bump what it changed, in the caller's (uncommitted) transaction."""
+    job.run(conn)
+    versions = notify.bump_settings_versions(conn, changed_channels) if changed_channels else {}
+    global_version = notify.bump_settings_version(conn, notify.GLOBAL_SCOPE) if global_changed else None
+    if counter_channels:
+        summary.refresh_top_uploaders(conn, counter_channels)
+    return versions, global_version
+
+def publish_bulk_changes(versions, global_version, counter_channels):
+    # Only called after the commit, so the bot never reloads settings that could still roll back
+    for channel_id, version in versions.items():
+        notify.publish('channel', channel_id=channel_id, version=version)
+    if global_version is not None:
+        notify.publish('global', version=global_version)
+    if counter_channels:
+        notify.publish('counters', channel_ids=list(counter_channels))
+
+def run_background_job(job_id, job, changed_channels, counter_channels, global_changed, result):
+    result = dict(result, rows=job.total)
+    try:
+        with db_pool.connection('bulk_job') as conn:
+            versions, global_version = apply_bulk_job(conn, job, changed_channels, counter_channels, global_changed)
+            # Marked done in the same transaction, so a successful job is never reported as failed
+            conn.execute("UPDATE bulk_jobs SET status = 'success', result = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (json.dumps(result), job_id))
+            conn.commit()
+    except Exception as e:
+        log.exception("Bulk job failed", extra={'fields': {'job_id': job_id}})
+        with db_pool.connection('bulk_job') as conn:
+            conn.execute("UPDATE bulk_jobs SET status = 'error', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (str(e), job_id))
+            conn.commit()
+        return
+    publish_bulk_changes(versions, global_version, counter_channels)
+
+def run_bulk_job(job, changed_channels=(), counter_channels=(), global_changed=False, **result):
+    """Run ``job`` in one transaction, then notify the bot once it has committed.
+
+    Small jobs commit before the response is sent. Jobs over
+    BULK_BACKGROUND_ROWS rows run in a background thread instead: the
+    response is a 202 with a status URL to poll, and no client ever holds
+    the write lock open while it reads.
+    """
+    total = job.total
+    if total <= bulk.BULK_BACKGROUND_ROWS:
+        try:
+            with get_db_connection() as conn:
+                versions, global_version = apply_bulk_job(conn, job, changed_channels, counter_channels, global_changed)
+                conn.commit()
+        except sqlite3.Error as e:
+            log.exception("Bulk operation failed")
+            return jsonify({'status': 'error', 'error': str(e)}), 500
+        publish_bulk_changes(versions, global_version, counter_channels)
+        return jsonify(dict(result, status='success', rows=total))
+
+    with get_db_connection() as conn:
+        job_id = conn.execute("INSERT INTO bulk_jobs (kind, status, total_rows) VALUES (?, 'running', ?)",
+                              (request.endpoint, total)).lastrowid
+        conn.commit()
+    # Not a daemon: a worker shutting down waits for the job instead of killing it half way
+    threading.Thread(target=run_background_job, name=f'bulk-job-{job_id}',
+                     args=(job_id, job, list(changed_channels), list(counter_channels), global_changed, result)).start()
+    return jsonify({'status': 'running', 'job_id': job_id, 'rows': total,
+                    'status_url': url_for('bulk_job_status', job_id=job_id)}), 202
+
+@app.route('/api/bulk/jobs/<int:job_id>')
+def bulk_job_status(job_id):
+    with get_db_connection() as conn:
+        job = conn.execute("SELECT * FROM bulk_jobs WHERE id = ?", (job_id,)).fetchone()
+    if job is None:
+        abort(404, "Unknown bulk job")
+    status = {'job_id': job['id'], 'kind': job['kind'], 'status': job['status'], 'rows': job['total_rows'],
+              'created_at': job['created_at'], 'finished_at': job['finished_at']}
+    if job['result']:
+        status.update(json.loads(job['result']))
+    if job['error']:
+        status['error'] = job['error']
+    return jsonify(status)
+
+@app.route('/api/bulk/apply_template', methods=['POST'])
+def bulk_apply_template():
+    data = request_object()
+    channel_ids = parse_channel_ids(data.get('channel_ids'))
+    try:
+        if data.get('source_channel_id') is not None:
+            try:
+                source_channel_id = int(data['source_channel_id'])
+            except (TypeError, ValueError):
+                abort(400, "source_channel_id must be a channel ID")
+            with get_db_connection() as conn:
+                template = bulk.channel_template(conn, source_channel_id)
+            if template is None:
+                abort(404, "The source channel has no settings")
+        else:
+            template = bulk.parse_template(data.get('template'))
+    except ValueError as e:
+        abort(400, str(e))
+    job = bulk.replace_channels_job(dict.fromkeys(channel_ids, template))
+    return run_bulk_job(job, changed_channels=channel_ids, channels=len(channel_ids))
+
+@app.route('/api/bulk/reset', methods=['POST'])
+def bulk_reset():
+    data = request_object()
+    role_name = data.get('role_name')
+    if role_name:
+        # Only the bot knows who holds a role; each bot process resets the members it can see
+        channel_ids = parse_channel_ids(data['channel_ids']) if data.get('channel_ids') else None
+        notify.publish('reset_role', role_name=role_name, channel_ids=channel_ids)
+        return jsonify({'status': 'queued', 'role_name': role_name}), 202
+    channel_ids = parse_channel_ids(data.get('channel_ids'))
+    return run_bulk_job(bulk.reset_channels_job(channel_ids), counter_channels=channel_ids, channels=len(channel_ids))
+
+@app.route('/api/config/export')
+def export_config():
+    export_format = request.args.get('format', 'json')
+    if export_format not in ('json', 'csv'):
+        abort(400, "format must be 'json' or 'csv'")
+    with get_db_connection() as conn:
+        config = bulk.export_config(conn)
+    if export_format == 'csv':
+        return Response(bulk.export_csv(config), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=upload_limits.csv'})
+    return jsonify(config)
+
+@app.route('/api/config/import', methods=['POST'])
+def import_config():
+    """Replace the settings of every channel in a JSON or CSV export; other channels are untouched."""
+    upload = request.files.get('file')
+    try:
+        if upload is not None:
+            text = upload.read().decode('utf-8-sig')
+            data = bulk.config_from_csv(text) if upload.filename.lower().endswith('.csv') else json.loads(text)
+        elif request.mimetype == 'text/csv':
+            data = bulk.config_from_csv(request.get_data(as_text=True))
+        else:
+            data = request_object()
+        config = bulk.parse_config(data)
+    except ValueError as e:
+        abort(400, str(e))
+    channel_ids = [channel['channel_id'] for channel in config['channels']]
+    return run_bulk_job(bulk.import_job(config), changed_channels=channel_ids,
+                        global_changed='default_max_uploads' in config, channels=len(channel_ids))
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
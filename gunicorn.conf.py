@@ -0,0 +1,17 @@
+# Gunicorn settings for the dashboard (loaded automatically from the working directory)
+import multiprocessing
+import os
+
+bind = os.getenv('DASHBOARD_BIND', '0.0.0.0:5000')
+
+# Threaded workers: requests mostly wait on SQLite or stream (/api/users), and the
+# threads of a worker share its connection pools, page cache and metrics registry.
+# SQLite has a single writer, so a few processes are enough.
+worker_class = 'gthread'
+workers = int(os.getenv('DASHBOARD_WORKERS', min(multiprocessing.cpu_count() + 1, 4)))
+threads = int(os.getenv('DASHBOARD_THREADS', 4))
+
+# Admin pages are polled; keep connections open between polls
+keepalive = 5
+timeout = 60
+graceful_timeout = 30
@@ -1,7 +1,13 @@
 import threading
+from dotenv import load_dotenv, find_dotenv
+
+# Load environment variables before the bot and dashboard modules read them at import
+load_dotenv(find_dotenv(usecwd=True), override=True)
+
 from bot.bot import run_bot
 from dashboard.dashboard import app
 
+# Development only: production runs the bot and gunicorn (gunicorn.conf.py) under supervisord
 def run_flask():
     app.run(host='0.0.0.0', port=5000)
 
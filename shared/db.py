@@ -0,0 +1,158 @@
+import asyncio
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+import aiosqlite
+
+from shared.metrics import DB_OPERATION_SECONDS, DB_POOL_WAIT_SECONDS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Size of sqlite3's per-connection prepared statement cache. Connections are long-lived,
+# so repeated queries reuse their compiled statements instead of re-preparing them.
+STATEMENT_CACHE_SIZE = 256
+
+
+def database_path():
+    # Shared by the bot and the dashboard; relative paths resolve against the project root
+    return os.path.join(PROJECT_ROOT, os.getenv('DATABASE_PATH', 'file_uploads.db'))
+
+
+def _pragma_statements(readonly=False):
+    # WAL lets dashboard reads run alongside bot writes, and synchronous=NORMAL
+    # is durable across application crashes in WAL mode.
+    pragmas = (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', int(os.getenv('DATABASE_BUSY_TIMEOUT_MS', 5000))),
+        ('cache_size', -int(os.getenv('DATABASE_CACHE_KB', 16384))),
+        ('mmap_size', int(os.getenv('DATABASE_MMAP_BYTES', 256 * 1024 * 1024))),
+        ('temp_store', 'MEMORY'),
+    )
+    if readonly:
+        # Journal settings belong to the writers; a read-only connection cannot change them
+        pragmas = pragmas[2:]
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas]
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived sqlite3 connections for the dashboard.
+
+    With ``readonly`` the connections are opened in SQLite's read-only mode
+    (or with query_only while the database file does not exist yet), so they
+    can never take the write lock the bot needs.
+    """
+
+    def __init__(self, path=None, size=4, readonly=False):
+        self.path = path or database_path()
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.readonly:
+            try:
+                conn = sqlite3.connect(f"{pathlib.Path(os.path.abspath(self.path)).as_uri()}?mode=ro", uri=True,
+                                       check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            except sqlite3.OperationalError:
+                # mode=ro cannot open a database the bot has not created yet; create it
+                # and make this connection refuse writes instead
+                conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+                conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for statement in _pragma_statements(self.readonly):
+            conn.execute(statement)
+        return conn
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self, operation='other'):
+        with DB_POOL_WAIT_SECONDS.time():
+            conn = self._get()
+        try:
+            with DB_OPERATION_SECONDS.labels(operation).time():
+                yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+class AsyncConnectionPool:
+    """Pool of long-lived aiosqlite connections for the bot's event loop."""
+
+    def __init__(self, path=None, size=4):
+        self.path = path or database_path()
+        self.size = size
+        self._idle = []
+        self._all = []
+        self._available = None
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for statement in _pragma_statements():
+            await db.execute(statement)
+        return db
+
+    @asynccontextmanager
+    async def acquire(self, operation='other'):
+        if self._available is None:
+            self._available = asyncio.Semaphore(self.size)
+        with DB_POOL_WAIT_SECONDS.time():
+            await self._available.acquire()
+        try:
+            db = self._idle.pop() if self._idle else None
+            if db is None:
+                db = await self._connect()
+                self._all.append(db)
+            try:
+                with DB_OPERATION_SECONDS.labels(operation).time():
+                    yield db
+            except Exception:
+                await db.rollback()
+                raise
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
+                self._idle.append(db)
+        finally:
+            self._available.release()
+
+    async def close(self):
+        for db in self._all:
+            await db.close()
+        self._all.clear()
+        self._idle.clear()
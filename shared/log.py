@@ -0,0 +1,47 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+_listener = None
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats records as ``key=value`` pairs, including any ``fields`` passed via ``extra``."""
+
+    def format(self, record):
+        parts = [
+            f"ts={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+            f"msg={record.getMessage()!r}",
+        ]
+        for key, value in getattr(record, 'fields', {}).items():
+            parts.append(f"{key}={value}")
+        if record.exc_info:
+            parts.append(f"exc={self.formatException(record.exc_info)!r}")
+        return ' '.join(parts)
+
+
+def setup_logging(level=None):
+    """Route logging through a background thread so handlers never block the caller.
+
+    The level comes from LOG_LEVEL (default INFO); records below it are
+    dropped before any formatting work is done.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(logging.handlers.QueueHandler(records))
+
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
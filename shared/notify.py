@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+log = logging.getLogger(__name__)
+
+# Scope used for settings that apply to every channel (global_settings)
+GLOBAL_SCOPE = 0
+
+
+def _notify_address(offset=0):
+    # Sharded bots run one listener per process on consecutive ports (see bot/sharding.py)
+    host, _, port = os.getenv('SETTINGS_NOTIFY_ADDR', '127.0.0.1:8765').rpartition(':')
+    return host, int(port) + offset
+
+
+def _listener_count():
+    return int(os.getenv('SHARD_PROCESSES', 1))
+
+
+BUMP_SETTINGS_VERSION = """
+    INSERT INTO settings_versions (scope_id, version) VALUES (?, 1)
+    ON CONFLICT(scope_id) DO UPDATE SET version = version + 1
+"""
+
+
+def bump_settings_version(conn, scope_id):
+    """Increment the settings version of a channel (or GLOBAL_SCOPE) inside the caller's transaction."""
+    conn.execute(BUMP_SETTINGS_VERSION, (scope_id,))
+    return conn.execute("SELECT version FROM settings_versions WHERE scope_id = ?", (scope_id,)).fetchone()[0]
+
+
+def bump_settings_versions(conn, scope_ids):
+    """``bump_settings_version`` for many scopes at once; returns ``{scope_id: version}``."""
+    scope_ids = list(scope_ids)
+    conn.executemany(BUMP_SETTINGS_VERSION, [(scope_id,) for scope_id in scope_ids])
+    versions = {}
+    # Chunked to stay under SQLite's bound parameter limit
+    for start in range(0, len(scope_ids), 500):
+        chunk = scope_ids[start:start + 500]
+        versions.update(conn.execute(f"SELECT scope_id, version FROM settings_versions WHERE scope_id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+    return versions
+
+
+def publish(kind, **fields):
+    """Send a fire-and-forget change notification to the bot over local UDP.
+
+    Losing a datagram only delays the bot picking up the change until its
+    periodic version check (RULES_RECHECK_SECONDS, see bot/rules.py), so send
+    errors are ignored.
+    """
+    payload = json.dumps(dict(fields, kind=kind)).encode()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for offset in range(_listener_count()):
+                sock.sendto(payload, _notify_address(offset))
+    except OSError as e:
+        log.warning("Unable to publish change notification", extra={'fields': {'kind': kind, 'error': str(e)}})
+
+
+class _NotificationProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(message, dict) and 'kind' in message:
+            self.callback(message)
+
+
+async def listen(callback, offset=0):
+    """Start receiving change notifications; returns the transport so the caller can close it."""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _NotificationProtocol(callback), local_addr=_notify_address(offset))
+    return transport
@@ -0,0 +1,38 @@
+import datetime
+import functools
+import os
+
+import pytz
+
+# Timezone used for channels that have not configured their own
+DEFAULT_TIMEZONE = os.getenv('RESET_TIMEZONE', 'US/Eastern')
+
+# Counters untouched for longer than the longest window are always outside their current period
+STALE_AFTER = datetime.timedelta(days=8)
+
+
+@functools.lru_cache(maxsize=None)
+def _timezone(name):
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def is_valid_timezone(name):
+    return name in pytz.all_timezones_set
+
+
+def period_id(reset_frequency, timezone=None, now=None):
+    """Identify the upload window containing ``now`` in the given timezone.
+
+    Daily windows look like ``2024-05-31`` and weekly windows are ISO weeks
+    (``2024-W22``, starting Monday). A counter whose stored period differs
+    from the current one is treated as zero, so resets need no sweep.
+    """
+    now = now or datetime.datetime.now(pytz.utc)
+    local = now.astimezone(_timezone(timezone))
+    if reset_frequency == 'weekly':
+        year, week, _ = local.isocalendar()
+        return f"{year}-W{week:02d}"
+    return local.strftime('%Y-%m-%d')
@@ -0,0 +1,108 @@
+import json
+
+# channel_summary holds everything the channels overview needs, one row per channel.
+# Triggers keep the rule count, blocked flag and upload totals current as the
+# underlying tables change; top uploaders are refreshed by the writers that
+# change counters (see refresh_top_uploaders).
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS channel_summary
+       (channel_id INTEGER PRIMARY KEY,
+        role_count INTEGER NOT NULL DEFAULT 0,
+        is_blocked INTEGER NOT NULL DEFAULT 0,
+        total_uploads INTEGER NOT NULL DEFAULT 0,
+        user_count INTEGER NOT NULL DEFAULT 0,
+        top_uploaders TEXT NOT NULL DEFAULT '[]')''',
+
+    '''CREATE INDEX IF NOT EXISTS idx_user_channel_uploads_top
+       ON user_channel_uploads (channel_id, uploads DESC)''',
+]
+
+_ROLE_COUNT = '''
+    INSERT INTO channel_summary (channel_id, role_count)
+    VALUES ({ref}.channel_id, (SELECT COUNT(DISTINCT role_name) FROM channel_settings WHERE channel_id = {ref}.channel_id))
+    ON CONFLICT(channel_id) DO UPDATE SET role_count = excluded.role_count;
+'''
+
+TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS channel_summary_settings_insert
+        AFTER INSERT ON channel_settings BEGIN {_ROLE_COUNT.format(ref='NEW')} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS channel_summary_settings_delete
+        AFTER DELETE ON channel_settings BEGIN {_ROLE_COUNT.format(ref='OLD')} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS channel_summary_settings_update
+        AFTER UPDATE OF channel_id, role_name ON channel_settings BEGIN
+            {_ROLE_COUNT.format(ref='OLD')}
+            {_ROLE_COUNT.format(ref='NEW')}
+        END''',
+
+    '''CREATE TRIGGER IF NOT EXISTS channel_summary_blocked_insert
+       AFTER INSERT ON blocked_channels BEGIN
+           INSERT INTO channel_summary (channel_id, is_blocked) VALUES (NEW.channel_id, 1)
+           ON CONFLICT(channel_id) DO UPDATE SET is_blocked = 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS channel_summary_blocked_delete
+       AFTER DELETE ON blocked_channels BEGIN
+           UPDATE channel_summary SET is_blocked = 0 WHERE channel_id = OLD.channel_id;
+       END''',
+
+    # total_uploads counts every accepted upload: period rollovers and manual resets do not subtract
+    '''CREATE TRIGGER IF NOT EXISTS channel_summary_uploads_insert
+       AFTER INSERT ON user_channel_uploads BEGIN
+           INSERT INTO channel_summary (channel_id, total_uploads, user_count)
+           VALUES (NEW.channel_id, COALESCE(NEW.uploads, 0), 1)
+           ON CONFLICT(channel_id) DO UPDATE SET
+               total_uploads = total_uploads + excluded.total_uploads,
+               user_count = user_count + 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS channel_summary_uploads_update
+       AFTER UPDATE OF uploads ON user_channel_uploads BEGIN
+           UPDATE channel_summary
+           SET total_uploads = total_uploads + CASE
+               WHEN NEW.period_id IS OLD.period_id THEN MAX(COALESCE(NEW.uploads, 0) - COALESCE(OLD.uploads, 0), 0)
+               ELSE COALESCE(NEW.uploads, 0) END
+           WHERE channel_id = NEW.channel_id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS channel_summary_uploads_delete
+       AFTER DELETE ON user_channel_uploads BEGIN
+           UPDATE channel_summary SET user_count = user_count - 1 WHERE channel_id = OLD.channel_id;
+       END''',
+]
+
+# Fills channel_summary from the existing tables the first time it is created
+BACKFILL = '''
+    INSERT OR IGNORE INTO channel_summary (channel_id, role_count, is_blocked, total_uploads, user_count)
+    SELECT ids.channel_id,
+           (SELECT COUNT(DISTINCT role_name) FROM channel_settings cs WHERE cs.channel_id = ids.channel_id),
+           EXISTS (SELECT 1 FROM blocked_channels bc WHERE bc.channel_id = ids.channel_id),
+           (SELECT COALESCE(SUM(uploads), 0) FROM user_channel_uploads u WHERE u.channel_id = ids.channel_id),
+           (SELECT COUNT(*) FROM user_channel_uploads u WHERE u.channel_id = ids.channel_id)
+    FROM (SELECT channel_id FROM channel_names
+          UNION SELECT channel_id FROM channel_settings
+          UNION SELECT channel_id FROM blocked_channels
+          UNION SELECT channel_id FROM user_channel_uploads) ids
+    WHERE ids.channel_id IS NOT NULL
+'''
+
+TOP_UPLOADERS_LIMIT = 3
+
+TOP_UPLOADERS_QUERY = '''
+    SELECT username, uploads FROM user_channel_uploads
+    WHERE channel_id = ? AND uploads > 0
+    ORDER BY uploads DESC
+    LIMIT ?
+'''
+
+UPDATE_TOP_UPLOADERS = '''
+    INSERT INTO channel_summary (channel_id, top_uploaders) VALUES (?, ?)
+    ON CONFLICT(channel_id) DO UPDATE SET top_uploaders = excluded.top_uploaders
+'''
+
+
+def encode_top_uploaders(rows):
+    return json.dumps([{'username': username, 'uploads': uploads} for username, uploads in rows])
+
+
+def refresh_top_uploaders(conn, channel_ids):
+    """Recompute top uploaders for the given channels using a sqlite3 connection."""
+    for channel_id in channel_ids:
+        rows = conn.execute(TOP_UPLOADERS_QUERY, (channel_id, TOP_UPLOADERS_LIMIT)).fetchall()
+        conn.execute(UPDATE_TOP_UPLOADERS, (channel_id, encode_top_uploaders([tuple(row) for row in rows])))